@@ -0,0 +1,30 @@
+""" Настройки Gunicorn для production: gunicorn -c config/gunicorn.conf.py config.asgi:application """
+
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Uvicorn-воркеры обслуживают и асинхронные, и синхронные view; для чисто синхронного запуска через
+# config.wsgi:application можно указать GUNICORN_WORKER_CLASS=gthread
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# Под ASGI синхронные view выполняются в пуле потоков asgiref, его размер задает ASGI_THREADS
+os.environ.setdefault('ASGI_THREADS', str(threads))
+
+# Приложение импортируется один раз до форка, воркеры делят память с мастером
+preload_app = True
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # Соединения с базой и пул, созданные при предзагрузке, не должны делиться между процессами
+    from django.db import connections
+
+    connections.close_all()
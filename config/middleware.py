@@ -0,0 +1,126 @@
+import logging
+import random
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.timezone import now
+
+logger = logging.getLogger('config.profiling')
+
+# Последние профили запросов, доступные через служебный эндпоинт; deque с maxlen потокобезопасен на добавление
+profiles = deque(maxlen=settings.REQUEST_PROFILING_BUFFER_SIZE)
+
+
+class QueryRecorder:
+    """ Обертка execute_wrapper, считающая запросы, их время и повторяющийся SQL """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    def get_duplicates(self):
+        return {sql: count for sql, count in self.statements.items() if count > 1}
+
+
+class RequestProfilingMiddleware:
+    """ Замеряет время запроса и работу с базой у выборки запросов.
+
+    Результат отдается заголовком Server-Timing, пишется в лог и, если задан размер буфера,
+    сохраняется в кольцевой буфер. Запросы вне выборки обрабатываются без оберток.
+    Под ASGI middleware работает асинхронно и не переключает цепочку обработчиков в синхронный режим.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            self.install_wrappers(stack, recorder)
+            response = self.get_response(request)
+        self.save_profile(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        # Соединения привязаны к потоку, а ORM из async-кода ходит в базу через sync_to_async
+        # в общем потоке запроса, поэтому обертки ставятся и снимаются в том же потоке
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        stack = ExitStack()
+        await sync_to_async(self.install_wrappers)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.save_profile(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def install_wrappers(stack, recorder):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+    @staticmethod
+    def save_profile(request, response, recorder, total):
+        duplicates = recorder.get_duplicates()
+        profile = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user_id': getattr(getattr(request, 'user', None), 'pk', None),
+            'created_at': now().isoformat(),
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(recorder.duration * 1000, 2),
+            'queries': recorder.count,
+            'duplicate_queries': sum(duplicates.values()) - len(duplicates),
+            'duplicates': [
+                {'sql': sql, 'count': count}
+                for sql, count in Counter(duplicates).most_common(settings.REQUEST_PROFILING_DUPLICATES_LIMIT)
+            ],
+        }
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={profile["db_ms"]};desc="{profile["queries"]} queries"',
+            f'dup;desc="{profile["duplicate_queries"]} duplicated"',
+            f'total;dur={profile["total_ms"]}',
+        ])
+        logger.info(
+            'method=%s path=%s status=%s total_ms=%s db_ms=%s queries=%s duplicate_queries=%s',
+            profile['method'], profile['path'], profile['status'], profile['total_ms'],
+            profile['db_ms'], profile['queries'], profile['duplicate_queries'],
+            extra={'profile': profile},
+        )
+        if profiles.maxlen:
+            profiles.append(profile)
@@ -1,17 +1,27 @@
 import os
 from datetime import timedelta
+from importlib.util import find_spec
 from pathlib import Path
+
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-SECRET_KEY = 'django-insecure-m*t0dq(@=b7o#9tg%l33$jyzo@z@&_ztl^%gctu_*(vwh*&%g2'
+# Профиль запуска: development (по умолчанию) или production
+DJANGO_ENV = os.getenv('DJANGO_ENV', 'development')
+PRODUCTION = DJANGO_ENV == 'production'
+
+SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-m*t0dq(@=b7o#9tg%l33$jyzo@z@&_ztl^%gctu_*(vwh*&%g2')
+if PRODUCTION and SECRET_KEY.startswith('django-insecure'):
+    raise ImproperlyConfigured('В production нужно задать SECRET_KEY')
 
-DEBUG = True
+# С DEBUG Django хранит в памяти каждый SQL-запрос, поэтому в production он выключен
+DEBUG = os.getenv('DEBUG', str(not PRODUCTION)) == 'True'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.getenv('ALLOWED_HOSTS', '').split(',') if host]
 
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -32,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.middleware.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,6 +70,16 @@ TEMPLATES = [
     },
 ]
 
+if PRODUCTION:
+    # Шаблоны админки и swagger компилируются один раз на процесс
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'config.wsgi.application'
 
 REST_FRAMEWORK = {
@@ -71,17 +92,60 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Пагинация по ключу вместо постраничной для курсов, уроков и платежей
+KEYSET_PAGINATION_DEFAULT = os.getenv('KEYSET_PAGINATION_DEFAULT', 'False') == 'True'
+KEYSET_PAGINATION_MAX_PAGE_SIZE = 100
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "django.db.backends.postgresql",
         "NAME": os.getenv('POSTGRES_DB'),
         "USER": os.getenv('POSTGRES_USER'),
         "PASSWORD": os.getenv('POSTGRES_PASSWORD'),
         "HOST": os.getenv('HOST'),
         "PORT": os.getenv('PORT'),
+        # Постоянные соединения только для WSGI: под ASGI каждый поток sync_to_async держал бы свое соединение,
+        # поэтому по умолчанию соединения закрываются после запроса, а переиспользование дает пул
+        "CONN_MAX_AGE": int(os.getenv('DB_CONN_MAX_AGE', 0)),
+        "CONN_HEALTH_CHECKS": PRODUCTION,
     }
 }
 
+# Пул psycopg 3 вместо постоянных соединений под ASGI; Django не позволяет включить их одновременно
+if os.getenv('DB_POOL', str(PRODUCTION)) == 'True':
+    if not find_spec('psycopg_pool'):
+        raise ImproperlyConfigured('Для DB_POOL=True нужен пакет psycopg[pool]; без пула задайте DB_POOL=False')
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        },
+    }
+
+# Redis из docker-compose в продакшене, локальная память для тестов и разработки
+if os.getenv('CACHE_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_LOCATION'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+COURSE_CACHE_TIMEOUT = 60 * 60
+LESSON_BULK_MAX_ITEMS = 500
+SUBSCRIPTION_BULK_MAX_ITEMS = 500
+
+# Словарь полнотекстового поиска PostgreSQL для курсов и уроков
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -115,6 +179,21 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = "users.User"
 
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
+# Создавать сессию оплаты stripe в фоновой задаче, а не внутри запроса
+STRIPE_CHECKOUT_ASYNC = os.getenv('STRIPE_CHECKOUT_ASYNC', 'True') == 'True'
+STRIPE_PRICE_CACHE_TIMEOUT = 60 * 60 * 24
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+# Статус неоплаченной сессии перепроверяется в stripe не чаще раза в PAYMENT_STATUS_CACHE_TTL секунд
+PAYMENT_STATUS_CACHE_TTL = 10
+PAYMENT_FINAL_STATUS_CACHE_TIMEOUT = 60 * 60
+PAYMENT_ANALYTICS_CACHE_TTL = 60
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Время хранения признака модератора в кеше, 0 отключает межзапросный кеш
+MODERS_CACHE_TIMEOUT = int(os.getenv('MODERS_CACHE_TIMEOUT', 300))
+# Оплаченные курсы, уроки и подписки пользователя; кеш сбрасывается сигналами платежей и подписок
+ENTITLEMENTS_CACHE_TIMEOUT = 60 * 60
 
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
@@ -141,6 +220,14 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('EMAIL_HOST_USER')
 
+COURSE_UPDATE_EMAIL_CHUNK_SIZE = int(os.getenv('COURSE_UPDATE_EMAIL_CHUNK_SIZE', 500))
+
+# Профилирование запросов: доля замеряемых запросов и размер буфера для эндпоинта /profiling/requests/
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', 'False') == 'True'
+REQUEST_PROFILING_SAMPLE_RATE = float(os.getenv('REQUEST_PROFILING_SAMPLE_RATE', 0.01))
+REQUEST_PROFILING_BUFFER_SIZE = int(os.getenv('REQUEST_PROFILING_BUFFER_SIZE', 200))
+REQUEST_PROFILING_DUPLICATES_LIMIT = 5
+
 SIMPLE_JWT = {
     'TOKEN_OBTAIN_PAIR_SERIALIZER': 'users.serializers.CustomTokenObtainPairSerializer',
 }
\ No newline at end of file
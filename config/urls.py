@@ -4,6 +4,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from config.views import RequestProfileAPIView
+
 schema_view = get_schema_view(
    openapi.Info(
       title="Homework API",
@@ -21,6 +23,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls', namespace='users')),
     path('lms/', include('lms.urls', namespace='lms')),
+    path('profiling/requests/', RequestProfileAPIView.as_view(), name='request-profiles'),
 
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
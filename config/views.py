@@ -0,0 +1,17 @@
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from config.middleware import profiles
+
+
+class RequestProfileAPIView(APIView):
+    """ Последние профили запросов из кольцевого буфера, самые новые первыми """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        items = list(profiles)[::-1]
+        if request.query_params.get('duplicates') == 'true':
+            items = [item for item in items if item['duplicate_queries']]
+        return Response({'count': len(items), 'results': items})
@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from lms.models import Course
+
+
+@admin.register(Course)
+class CourseAdmin(admin.ModelAdmin):
+    list_display = ('title', 'owner', 'lessons_count', 'subscribers_count', 'updated_at')
+    readonly_fields = ('lessons_count', 'subscribers_count')
@@ -0,0 +1,154 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import Value
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from lms.models import Course, Lesson
+from lms.paginations import CustomPagination
+from lms.serializers import CourseSerializer, LessonSerializer
+from lms.services import add_user_flags, aget_course_bodies, get_visible_courses, get_visible_lessons, strip_user_flags
+from users.services import aget_entitlements
+
+# Асинхронные эндпоинты только для чтения каталога. Под ASGI они обслуживаются в цикле событий без выделения
+# потока на запрос; синхронный код (проверка JWT и сериализация промахов кеша) выполняется через sync_to_async.
+
+
+def get_authenticated_user(request):
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken):
+        return None
+    return result[0] if result else None
+
+
+def async_login_required(view):
+    """ Аутентифицирует запрос по JWT так же, как DRF, и передает пользователя во view """
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await sync_to_async(get_authenticated_user)(request)
+        if user is None or not user.is_active:
+            return JsonResponse({'detail': str(NotAuthenticated.default_detail)}, status=401)
+        return await view(request, user, *args, **kwargs)
+
+    return wrapper
+
+
+def not_found():
+    return JsonResponse({'detail': 'Страница не найдена.'}, status=404)
+
+
+def get_page_params(request):
+    """ Номер и размер страницы по тем же правилам, что и у CustomPagination """
+
+    paginator = CustomPagination
+    try:
+        page = int(request.GET.get(paginator.page_query_param, 1))
+        page_size = int(request.GET.get(paginator.page_size_query_param, paginator.page_size))
+    except ValueError:
+        return None, None
+    if page < 1 or page_size < 1:
+        return None, None
+    return page, min(page_size, paginator.max_page_size)
+
+
+def get_paginated_data(request, count, page, page_size, results):
+    url = request.build_absolute_uri()
+    page_param = CustomPagination.page_query_param
+    previous = None
+    if page > 1:
+        previous = replace_query_param(url, page_param, page - 1) if page > 2 else remove_query_param(url, page_param)
+    return {
+        'count': count,
+        'next': replace_query_param(url, page_param, page + 1) if page * page_size < count else None,
+        'previous': previous,
+        'results': results,
+    }
+
+
+async def paginate(request, queryset):
+    """ Возвращает (count, page, page_size, строки страницы) или None для несуществующей страницы """
+
+    page, page_size = get_page_params(request)
+    if page is None:
+        return None
+    count = await queryset.acount()
+    if page > 1 and (page - 1) * page_size >= count:
+        return None
+    offset = (page - 1) * page_size
+    rows = [row async for row in queryset[offset:offset + page_size]]
+    return count, page, page_size, rows
+
+
+def serialize_courses(request, course_ids, entitlements):
+    """ Та же сериализация, что у CourseViewSet, чтобы синхронные и асинхронные view делили кеш курсов """
+
+    queryset = Course.objects.filter(pk__in=course_ids).annotate(
+        annotated_is_subscribed=Value(False),
+    ).prefetch_related('lesson_set').order_by('pk')
+    context = {'request': request, 'entitlements': entitlements}
+    bodies = {}
+    for body in CourseSerializer(queryset, many=True, context=context).data:
+        bodies[body['id']] = strip_user_flags(body)
+    return bodies
+
+
+async def get_courses_data(request, user, course_ids):
+    entitlements = await aget_entitlements(user.pk)
+    bodies = await aget_course_bodies(course_ids, lambda ids: serialize_courses(request, ids, entitlements))
+    return add_user_flags(bodies, entitlements)
+
+
+@require_GET
+@async_login_required
+async def course_list(request, user):
+    course_ids = Course.objects.order_by('pk').values_list('id', flat=True)
+    page = await paginate(request, await sync_to_async(get_visible_courses)(user, course_ids))
+    if page is None:
+        return not_found()
+    count, number, page_size, course_ids = page
+    data = await get_courses_data(request, user, course_ids)
+    return JsonResponse(get_paginated_data(request, count, number, page_size, data))
+
+
+@require_GET
+@async_login_required
+async def course_detail(request, user, pk):
+    courses = await sync_to_async(get_visible_courses)(user)
+    if not await courses.filter(pk=pk).aexists():
+        return not_found()
+    data = await get_courses_data(request, user, [pk])
+    if not data:
+        return not_found()
+    return JsonResponse(data[0])
+
+
+@require_GET
+@async_login_required
+async def lesson_list(request, user):
+    lessons = await sync_to_async(get_visible_lessons)(user, Lesson.objects.order_by('pk'))
+    page = await paginate(request, lessons)
+    if page is None:
+        return not_found()
+    count, number, page_size, lessons = page
+    context = {'request': request, 'entitlements': await aget_entitlements(user.pk)}
+    data = LessonSerializer(lessons, many=True, context=context).data
+    return JsonResponse(get_paginated_data(request, count, number, page_size, data))
+
+
+@require_GET
+@async_login_required
+async def lesson_detail(request, user, pk):
+    try:
+        lessons = await sync_to_async(get_visible_lessons)(user)
+        lesson = await lessons.aget(pk=pk)
+    except Lesson.DoesNotExist:
+        return not_found()
+    context = {'request': request, 'entitlements': await aget_entitlements(user.pk)}
+    return JsonResponse(LessonSerializer(lesson, context=context).data)
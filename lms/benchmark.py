@@ -0,0 +1,280 @@
+import asyncio
+import json
+import math
+import random
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from uuid import uuid4
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from lms.imports import keep_imported_dates
+from lms.models import Course, Lesson, Subscription
+from lms.search import update_search_index
+from lms.services import recount_course_counters
+from users.models import Payment, User
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def seed_benchmark_data(users=100, courses=50, lessons_per_course=10, subscriptions_per_user=5,
+                        payments_per_user=3, batch_size=1000, seed=None):
+    """ Генерирует синтетические данные для нагрузочных замеров, возвращает количество созданных строк """
+
+    rng = random.Random(seed)
+    tag = uuid4().hex[:8]
+    password = make_password(None)
+    today = now()
+
+    user_objects = User.objects.bulk_create(
+        [User(email=f'bench-{tag}-{number}@example.com', password=password) for number in range(users)],
+        batch_size=batch_size,
+    )
+    course_objects = Course.objects.bulk_create(
+        [
+            Course(title=f'Курс {number}', description=f'Описание курса {number}', owner=rng.choice(user_objects))
+            for number in range(courses)
+        ],
+        batch_size=batch_size,
+    )
+    lesson_objects = Lesson.objects.bulk_create(
+        [
+            Lesson(title=f'Урок {number}', description=f'Урок {number} курса {course.pk}', course=course,
+                   owner=course.owner)
+            for course in course_objects for number in range(lessons_per_course)
+        ],
+        batch_size=batch_size,
+    )
+
+    update_search_index(Course, course_objects)
+    update_search_index(Lesson, lesson_objects)
+
+    subscriptions = [
+        Subscription(user=user, course=course)
+        for user in user_objects
+        for course in rng.sample(course_objects, min(subscriptions_per_user, len(course_objects)))
+    ]
+    payments = []
+    for user in user_objects:
+        for _ in range(payments_per_user if course_objects else 0):
+            lesson = rng.choice(lesson_objects) if lesson_objects and rng.random() < 0.5 else None
+            payments.append(Payment(
+                user=user,
+                paid_course=None if lesson else rng.choice(course_objects),
+                paid_lesson=lesson,
+                amount=Decimal(rng.randrange(100, 10000)) / 100,
+                payment_method=rng.choice(Payment.PAYMENT_METHOD_CHOICES)[0],
+                status=Payment.STATUS_PAID,
+                payment_date=today - timedelta(minutes=rng.randrange(365 * 24 * 60)),
+            ))
+    # Даты платежей разбрасываем по году, чтобы аналитика и выгрузки работали на реалистичных данных
+    with keep_imported_dates([Subscription, Payment]):
+        for subscription in subscriptions:
+            subscription.created_at = today
+        Subscription.objects.bulk_create(subscriptions, batch_size=batch_size)
+        Payment.objects.bulk_create(payments, batch_size=batch_size)
+
+    recount_course_counters()
+    return {
+        'users': len(user_objects),
+        'courses': len(course_objects),
+        'lessons': len(lesson_objects),
+        'subscriptions': len(subscriptions),
+        'payments': len(payments),
+    }
+
+
+def percentile(values, rank):
+    """ Процентиль по методу ближайшего ранга """
+
+    ordered = sorted(values)
+    return ordered[max(math.ceil(rank / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(values):
+    summary = {'min': min(values), 'mean': statistics.fmean(values), 'max': max(values)}
+    summary.update({f'p{rank}': percentile(values, rank) for rank in PERCENTILES})
+    return {key: round(value, 3) for key, value in summary.items()}
+
+
+def get_benchmark_scenarios():
+    """ Набор замеряемых запросов: (название, метод, адрес, тело, переключает ли запрос состояние) """
+
+    course = Course.objects.order_by('pk').first()
+    if course is None:
+        return []
+    return [
+        ('course_list', 'get', reverse('lms:course-list'), None, False),
+        ('course_detail', 'get', reverse('lms:course-detail', args=[course.pk]), None, False),
+        ('lesson_list', 'get', reverse('lms:lesson-list-create'), None, False),
+        ('subscribe_toggle', 'post', reverse('lms:subscribe'), {'course_id': course.pk}, True),
+        ('user_list', 'get', reverse('users:user-list'), None, False),
+        ('payment_list', 'get', reverse('users:payment-list-create'), None, False),
+    ]
+
+
+@contextmanager
+def benchmark_environment():
+    """ Тестовое окружение Django (testserver в ALLOWED_HOSTS, почта в памяти) на время замеров """
+
+    try:
+        setup_test_environment()
+    except RuntimeError:
+        # Окружение уже подготовлено, например при запуске из тестов
+        yield
+        return
+    try:
+        yield
+    finally:
+        teardown_test_environment()
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(client, method, url, data, iterations, warmup, toggle=False):
+    for _ in range(warmup):
+        getattr(client, method)(url, data, format='json')
+
+    latencies, queries, statuses = [], [], {}
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data, format='json')
+            latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(len(context.captured_queries))
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    if toggle and (warmup + iterations) % 2:
+        # Нечетное число переключений оставило бы подписку в другом состоянии
+        getattr(client, method)(url, data, format='json')
+    return {
+        'url': url,
+        'iterations': iterations,
+        'status_codes': statuses,
+        'latency_ms': summarize(latencies),
+        'queries': summarize(queries),
+    }
+
+
+def run_benchmark(user, iterations=50, warmup=5, scenarios=None):
+    """ Прогоняет запросы к API через тестовый клиент и собирает отчет с процентилями и числом запросов """
+
+    client = APIClient()
+    client.force_authenticate(user=user)
+    results = {}
+    with benchmark_environment():
+        for name, method, url, data, toggle in get_benchmark_scenarios():
+            if scenarios and name not in scenarios:
+                continue
+            results[name] = measure(client, method, url, data, iterations, warmup, toggle)
+
+    return {
+        'revision': get_git_revision(),
+        'created_at': now().isoformat(),
+        'user': user.email,
+        'dataset': {
+            'users': User.objects.count(),
+            'courses': Course.objects.count(),
+            'lessons': Lesson.objects.count(),
+            'subscriptions': Subscription.objects.count(),
+            'payments': Payment.objects.count(),
+        },
+        'results': results,
+    }
+
+
+def get_async_comparison_urls():
+    """ Пары (название, синхронный адрес, асинхронный адрес) для сравнения пропускной способности """
+
+    course = Course.objects.order_by('pk').first()
+    lesson = Lesson.objects.order_by('pk').first()
+    pairs = [
+        ('course_list', reverse('lms:course-list'), reverse('lms:async-course-list')),
+        ('lesson_list', reverse('lms:lesson-list-create'), reverse('lms:async-lesson-list')),
+    ]
+    if course:
+        pairs.append(('course_detail', reverse('lms:course-detail', args=[course.pk]),
+                      reverse('lms:async-course-detail', args=[course.pk])))
+    if lesson:
+        pairs.append(('lesson_detail', reverse('lms:lesson-detail', args=[lesson.pk]),
+                      reverse('lms:async-lesson-detail', args=[lesson.pk])))
+    return pairs
+
+
+async def measure_throughput(client, url, headers, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send():
+        async with semaphore:
+            return (await client.get(url, headers=headers)).status_code
+
+    started = time.perf_counter()
+    statuses = await asyncio.gather(*(send() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests_per_second': round(requests / elapsed, 1),
+        'elapsed_s': round(elapsed, 3),
+        'errors': sum(code >= 400 for code in statuses),
+    }
+
+
+def run_async_comparison(user, requests=200, concurrency=20):
+    """ Сравнивает запросы в секунду синхронных и асинхронных view при одинаковой конкурентности.
+
+    Запросы идут через ASGI-обработчик в одном процессе: синхронные view выполняются в единственном
+    потоке sync_to_async, как у одного воркера, асинхронные ждут базу и кеш, не блокируя друг друга.
+    """
+
+    headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+    pairs = get_async_comparison_urls()
+
+    async def compare():
+        client = AsyncClient()
+        results = {}
+        for name, sync_url, async_url in pairs:
+            results[name] = {
+                'sync': await measure_throughput(client, sync_url, headers, requests, concurrency),
+                'async': await measure_throughput(client, async_url, headers, requests, concurrency),
+            }
+        return results
+
+    with benchmark_environment():
+        results = asyncio.run(compare())
+    return {'requests': requests, 'concurrency': concurrency, 'results': results}
+
+
+def compare_reports(baseline, report):
+    """ Возвращает изменения p95 и среднего числа запросов относительно прошлого отчета """
+
+    changes = {}
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        changes[name] = {
+            'p95_ms': round(result['latency_ms']['p95'] - previous['latency_ms']['p95'], 3),
+            'queries': round(result['queries']['mean'] - previous['queries']['mean'], 3),
+        }
+    return changes
+
+
+def load_report(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
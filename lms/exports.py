@@ -0,0 +1,82 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.serializers import ChoiceField, DateField, Serializer
+
+from lms.models import Subscription
+
+
+class Echo:
+    """ Псевдофайл для csv.writer, возвращающий записанную строку вместо буферизации """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(fields, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_ndjson(fields, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv'),
+    'ndjson': (iter_ndjson, 'application/x-ndjson'),
+}
+
+# Выгрузки других приложений регистрируются через register_export_dataset в их AppConfig.ready
+EXPORT_DATASETS = {}
+
+
+def register_export_dataset(name, queryset, fields, date_field):
+    EXPORT_DATASETS[name] = {'queryset': queryset, 'fields': fields, 'date_field': date_field}
+
+
+register_export_dataset(
+    'subscriptions',
+    Subscription.objects.order_by('pk'),
+    ('id', 'user_id', 'user__email', 'course_id', 'course__title', 'created_at'),
+    'created_at',
+)
+
+
+class ExportQuerySerializer(Serializer):
+    export_format = ChoiceField(choices=list(EXPORT_FORMATS), default='csv')
+    date_from = DateField(required=False)
+    date_to = DateField(required=False)
+
+
+def iter_export(dataset, export_format='csv', date_from=None, date_to=None, chunk_size=None):
+    """ Построчно отдает выгрузку, читая базу кусками через values_list без создания моделей """
+
+    config = EXPORT_DATASETS[dataset]
+    queryset = config['queryset']
+    if date_from:
+        queryset = queryset.filter(**{f"{config['date_field']}__date__gte": date_from})
+    if date_to:
+        queryset = queryset.filter(**{f"{config['date_field']}__date__lte": date_to})
+    rows = queryset.values_list(*config['fields']).iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+    render, _ = EXPORT_FORMATS[export_format]
+    return render(config['fields'], rows)
+
+
+def export_response(request, dataset):
+    """ Потоковый ответ с выгрузкой по параметрам запроса export_format, date_from и date_to """
+
+    serializer = ExportQuerySerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    export_format = serializer.validated_data['export_format']
+    _, content_type = EXPORT_FORMATS[export_format]
+
+    response = StreamingHttpResponse(iter_export(dataset, **serializer.validated_data), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{export_format}"'
+    return response
@@ -0,0 +1,221 @@
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from lms.models import Course, Lesson, Subscription
+from lms.search import update_search_index
+from lms.services import bump_subscriptions_version, invalidate_courses, recount_course_counters
+from users.models import Payment
+from users.services import bump_payment_analytics_version
+
+# Порядок важен: родительские модели сбрасываются в базу раньше зависимых
+IMPORT_MODELS = {
+    'lms.course': Course,
+    'lms.lesson': Lesson,
+    'lms.subscription': Subscription,
+    'users.payment': Payment,
+}
+
+
+def iter_json_array(stream, chunk_size=64 * 1024):
+    """ Потоково разбирает JSON-массив объектов, не загружая файл в память целиком """
+
+    decoder = json.JSONDecoder()
+    buffer = stream.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Ожидается JSON-массив')
+    buffer = buffer[1:]
+
+    while True:
+        buffer = buffer.lstrip().removeprefix(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                if buffer:
+                    raise ValueError('Файл обрывается посреди объекта')
+                return
+            buffer += chunk
+            continue
+        yield obj
+        buffer = buffer[end:]
+
+
+def iter_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_objects(stream, file_format='auto'):
+    if file_format == 'auto':
+        position = stream.tell()
+        first = stream.read(64).lstrip()[:1]
+        stream.seek(position)
+        file_format = 'json' if first == '[' else 'ndjson'
+    return iter_json_array(stream) if file_format == 'json' else iter_ndjson(stream)
+
+
+@contextmanager
+def keep_imported_dates(models):
+    """ Отключает auto_now/auto_now_add, чтобы bulk_create сохранил даты из файла """
+
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    flags = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield [field for field, *_ in flags]
+    finally:
+        for field, auto_now, auto_now_add in flags:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class CatalogImporter:
+    """ Пакетный импорт курсов, уроков, подписок и платежей с переназначением внешних ключей.
+
+    Строки пишутся через bulk_create, поэтому сигналы на каждую строку не вызываются: поисковые векторы
+    обновляются на каждую пачку, а счетчики курсов, кеши и версии подписок один раз в конце импорта.
+    """
+
+    def __init__(self, batch_size=1000, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.id_maps = {model: {} for model in IMPORT_MODELS.values()}
+        # Ссылки на строки, которых нет в файле, но которые уже есть в базе
+        self.existing_pks = {model: {} for model in IMPORT_MODELS.values()}
+        self.pending = {model: [] for model in IMPORT_MODELS.values()}
+        self.created = Counter()
+        self.skipped = Counter()
+        # Пользователи, у которых поменялись подписки или оплаты, а значит версия подписок и права
+        self.entitled_user_ids = set()
+        self.date_fields = set()
+        self.started = None
+
+    def run(self, objects):
+        self.started = time.monotonic()
+        with keep_imported_dates(IMPORT_MODELS.values()) as date_fields:
+            self.date_fields = set(date_fields)
+            for obj in objects:
+                self.add(obj)
+            for model in IMPORT_MODELS.values():
+                self.flush(model)
+
+        recount_course_counters()
+        invalidate_courses(self.id_maps[Course].values())
+        for user_id in self.entitled_user_ids:
+            bump_subscriptions_version(user_id)
+        bump_payment_analytics_version()
+        return self.get_stats()
+
+    def add(self, obj):
+        model = IMPORT_MODELS.get(obj.get('model', '').lower())
+        if model is None:
+            self.skipped[obj.get('model')] += 1
+            return
+        instance = self.build(model, obj.get('fields', {}))
+        if instance is None:
+            self.skipped[obj['model']] += 1
+            return
+        self.pending[model].append((obj.get('pk'), instance))
+        if len(self.pending[model]) >= self.batch_size:
+            self.flush(model)
+
+    def resolve(self, model, old_pk):
+        """ Возвращает новый id родителя, при необходимости сбрасывая его незаписанную пачку.
+
+        Если родителя нет в файле, ссылка сохраняется на существующую строку базы с тем же id, иначе None.
+        """
+
+        if old_pk is None:
+            return None
+        if old_pk not in self.id_maps[model] and any(pk == old_pk for pk, _ in self.pending[model]):
+            self.flush(model)
+        if old_pk in self.id_maps[model]:
+            return self.id_maps[model][old_pk]
+        if old_pk not in self.existing_pks[model]:
+            exists = model.objects.filter(pk=old_pk).exists()
+            self.existing_pks[model][old_pk] = old_pk if exists else None
+        return self.existing_pks[model][old_pk]
+
+    def build(self, model, fields):
+        values = {}
+        for field in model._meta.concrete_fields:
+            if field.primary_key or field.name not in fields:
+                continue
+            value = fields[field.name]
+            if field.is_relation and field.related_model in self.id_maps:
+                value = self.resolve(field.related_model, value)
+                # Строку с битой ссылкой пропускаем, а не обнуляем ссылку даже у необязательного поля
+                if value is None and fields[field.name] is not None:
+                    return None
+            values[field.attname] = value
+
+        # Даты, которых нет в файле, заполняем так же, как это сделали бы auto_now/auto_now_add
+        for field in model._meta.concrete_fields:
+            if field in self.date_fields:
+                values.setdefault(field.attname, now())
+        if model in (Subscription, Payment):
+            self.entitled_user_ids.add(values.get('user_id'))
+        return model(**values)
+
+    def flush(self, model):
+        pending, self.pending[model] = self.pending[model], []
+        if model is Subscription:
+            pending = self.exclude_existing_subscriptions(pending)
+        if not pending:
+            return
+        with transaction.atomic():
+            # Подписки, появившиеся параллельно с импортом, пропускаем на уровне уникального ограничения
+            objects = model.objects.bulk_create(
+                [instance for _, instance in pending], ignore_conflicts=model is Subscription,
+            )
+        if model in (Course, Lesson):
+            update_search_index(model, objects)
+        for (old_pk, _), instance in zip(pending, objects):
+            if old_pk is not None:
+                self.id_maps[model][old_pk] = instance.pk
+        self.created[model._meta.label_lower] += len(objects)
+        if self.progress:
+            self.progress(self.get_stats())
+
+    def exclude_existing_subscriptions(self, pending):
+        """ Убирает из пачки подписки, которые уже есть в базе или повторяются в файле, и считает их пропущенными """
+
+        existing = set(
+            Subscription.objects.filter(
+                user_id__in={instance.user_id for _, instance in pending},
+                course_id__in={instance.course_id for _, instance in pending},
+            ).values_list('user_id', 'course_id')
+        )
+        new = []
+        for old_pk, instance in pending:
+            key = (instance.user_id, instance.course_id)
+            if key in existing:
+                self.skipped[Subscription._meta.label_lower] += 1
+                continue
+            existing.add(key)
+            new.append((old_pk, instance))
+        return new
+
+    def get_stats(self):
+        elapsed = time.monotonic() - self.started
+        total = sum(self.created.values())
+        return {
+            'created': dict(self.created),
+            'skipped': dict(self.skipped),
+            'total': total,
+            'elapsed': elapsed,
+            'rows_per_second': total / elapsed if elapsed else 0,
+        }
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management import BaseCommand
+
+from lms.exports import EXPORT_DATASETS, EXPORT_FORMATS, iter_export
+
+
+class Command(BaseCommand):
+    help = 'Потоково выгружает платежи или подписки в CSV или NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(EXPORT_DATASETS))
+        parser.add_argument('--format', dest='export_format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--date-from', help='Начальная дата в формате ГГГГ-ММ-ДД')
+        parser.add_argument('--date-to', help='Конечная дата в формате ГГГГ-ММ-ДД')
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--output', help='Файл для выгрузки, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        lines = iter_export(
+            options['dataset'],
+            export_format=options['export_format'],
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            chunk_size=options['chunk_size'],
+        )
+        started = time.monotonic()
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                rows = self.write_lines(lines, output.write)
+        else:
+            rows = self.write_lines(lines, lambda line: self.stdout.write(line, ending=''))
+        self.stderr.write(f'Выгружено строк: {rows} за {time.monotonic() - started:.1f} с')
+
+    def write_lines(self, lines, write):
+        rows = 0
+        for line in lines:
+            write(line)
+            rows += 1
+        return rows
@@ -0,0 +1,35 @@
+from django.core.management import BaseCommand, CommandError
+
+from lms.imports import CatalogImporter, iter_objects
+
+
+class Command(BaseCommand):
+    help = 'Потоково импортирует курсы, уроки, подписки и платежи из JSON или NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл в формате фикстуры Django (JSON-массив) или NDJSON')
+        parser.add_argument('--format', dest='file_format', choices=('auto', 'json', 'ndjson'), default='auto')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пачки должен быть положительным')
+
+        importer = CatalogImporter(batch_size=options['batch_size'], progress=self.write_progress)
+        with open(options['path'], encoding='utf-8') as stream:
+            try:
+                stats = importer.run(iter_objects(stream, options['file_format']))
+            except ValueError as error:
+                raise CommandError(f'Не удалось разобрать файл: {error}')
+
+        for label, count in sorted(stats['created'].items()):
+            self.stdout.write(f'{label}: создано {count}')
+        for label, count in sorted(stats['skipped'].items(), key=str):
+            self.stdout.write(f'{label}: пропущено {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано строк: {stats["total"]} за {stats["elapsed"]:.1f} с '
+            f'({stats["rows_per_second"]:.0f} строк/с)'
+        ))
+
+    def write_progress(self, stats):
+        self.stderr.write(f'... {stats["total"]} строк, {stats["rows_per_second"]:.0f} строк/с')
@@ -0,0 +1,11 @@
+from django.core.management import BaseCommand
+
+from lms.services import recount_course_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счетчики уроков и подписчиков курсов'
+
+    def handle(self, *args, **options):
+        fixed = recount_course_counters()
+        self.stdout.write(self.style.SUCCESS(f'Исправлено курсов: {fixed}'))
@@ -0,0 +1,55 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+
+from lms.benchmark import compare_reports, load_report, run_async_comparison, run_benchmark
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержки и число SQL-запросов основных эндпоинтов API и сохраняет отчет в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help='Пользователь, от имени которого идут запросы')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--scenario', action='append', dest='scenarios', help='Замерить только этот сценарий')
+        parser.add_argument('--output', help='Файл для отчета, по умолчанию stdout')
+        parser.add_argument('--compare', help='Прошлый отчет для сравнения')
+        parser.add_argument('--async-requests', type=int, default=0,
+                            help='Сравнить пропускную способность синхронных и асинхронных view на N запросах')
+        parser.add_argument('--concurrency', type=int, default=20)
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        user = users.filter(email=options['email']).first() if options['email'] else users.first()
+        if user is None:
+            raise CommandError('Пользователь не найден, сначала выполните seed_benchmark')
+
+        report = run_benchmark(
+            user, iterations=options['iterations'], warmup=options['warmup'], scenarios=options['scenarios'],
+        )
+        if options['async_requests']:
+            report['async_comparison'] = run_async_comparison(
+                user, requests=options['async_requests'], concurrency=options['concurrency'],
+            )
+        if options['compare']:
+            report['changes'] = compare_reports(load_report(options['compare']), report)
+
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(content)
+        else:
+            self.stdout.write(content)
+
+        for name, result in report['results'].items():
+            latency = result['latency_ms']
+            self.stderr.write(
+                f'{name}: p50 {latency["p50"]} мс, p95 {latency["p95"]} мс, запросов {result["queries"]["mean"]}'
+            )
+        for name, result in report.get('async_comparison', {}).get('results', {}).items():
+            self.stderr.write(
+                f'{name}: sync {result["sync"]["requests_per_second"]} запр/с, '
+                f'async {result["async"]["requests_per_second"]} запр/с'
+            )
@@ -0,0 +1,30 @@
+from django.core.management import BaseCommand
+
+from lms.benchmark import seed_benchmark_data
+
+
+class Command(BaseCommand):
+    help = 'Генерирует пользователей, курсы, уроки, подписки и платежи для нагрузочных замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--courses', type=int, default=50)
+        parser.add_argument('--lessons-per-course', type=int, default=10)
+        parser.add_argument('--subscriptions-per-user', type=int, default=5)
+        parser.add_argument('--payments-per-user', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, help='Зерно генератора для воспроизводимых данных')
+
+    def handle(self, *args, **options):
+        counts = seed_benchmark_data(
+            users=options['users'],
+            courses=options['courses'],
+            lessons_per_course=options['lessons_per_course'],
+            subscriptions_per_user=options['subscriptions_per_user'],
+            payments_per_user=options['payments_per_user'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+        )
+        for name, count in counts.items():
+            self.stdout.write(f'{name}: {count}')
+        self.stdout.write(self.style.SUCCESS('Данные для замеров созданы'))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_course_counters(apps, schema_editor):
+    Course = apps.get_model('lms', 'Course')
+    Lesson = apps.get_model('lms', 'Lesson')
+    Subscription = apps.get_model('lms', 'Subscription')
+
+    lessons = Lesson.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(
+        total=Count('pk')).values('total')
+    subscribers = Subscription.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(
+        total=Count('pk')).values('total')
+    Course.objects.update(
+        lessons_count=Coalesce(Subquery(lessons), 0),
+        subscribers_count=Coalesce(Subquery(subscribers), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0007_course_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='lessons_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество уроков'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество подписчиков'),
+        ),
+        migrations.RunPython(fill_course_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:25
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+from django.db.models.functions import Greatest
+
+
+def remove_duplicate_subscriptions(apps, schema_editor):
+    Course = apps.get_model('lms', 'Course')
+    Subscription = apps.get_model('lms', 'Subscription')
+
+    duplicates = Subscription.objects.order_by().values('user', 'course').annotate(
+        first_id=Min('pk'), total=Count('pk')).filter(total__gt=1)
+    for row in duplicates.iterator():
+        Subscription.objects.filter(user=row['user'], course=row['course']).exclude(pk=row['first_id']).delete()
+        Course.objects.filter(pk=row['course']).update(
+            subscribers_count=Greatest(F('subscribers_count') - (row['total'] - 1), 0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0008_course_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_subscriptions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(fields=('user', 'course'), name='subscription_user_course_unique'),
+        ),
+    ]
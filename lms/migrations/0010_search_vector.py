@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:27
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+SEARCH_INDEXES = {'lms_course': 'lms_course_search_gin', 'lms_lesson': 'lms_lesson_search_gin'}
+
+
+def create_search_indexes(apps, schema_editor):
+    # GIN-индекс и tsvector есть только в PostgreSQL, на SQLite поиск работает через индекс в памяти
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    vector = SearchVector('title', weight='A', config=settings.SEARCH_CONFIG) + \
+        SearchVector('description', weight='B', config=settings.SEARCH_CONFIG)
+    for model_name in ('Course', 'Lesson'):
+        apps.get_model('lms', model_name).objects.update(search_vector=vector)
+    for table, index in SEARCH_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX {index} ON {table} USING gin (search_vector)')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index in SEARCH_INDEXES.values():
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0009_subscription_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
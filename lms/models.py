@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
 from lms.validators import validate_links
@@ -14,6 +15,10 @@ class Course(models.Model):
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='lessons', verbose_name='Владелец', **NULLABLE
     )
     updated_at = models.DateTimeField(auto_now=True)
+    lessons_count = models.PositiveIntegerField(default=0, verbose_name='Количество уроков')
+    subscribers_count = models.PositiveIntegerField(default=0, verbose_name='Количество подписчиков')
+    # Заполняется lms.search при сохранении, GIN-индекс создается миграцией только на PostgreSQL
+    search_vector = SearchVectorField(editable=False, **NULLABLE)
 
     class Meta:
         verbose_name = 'Курс'
@@ -34,9 +39,15 @@ class Lesson(models.Model):
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='courses', verbose_name='Владелец', **NULLABLE
     )
+    search_vector = SearchVectorField(editable=False, **NULLABLE)
 
 
 class Subscription(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="subscriptions")
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="subscriptions")
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('user', 'course'), name='subscription_user_course_unique'),
+        ]
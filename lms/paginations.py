@@ -1,7 +1,39 @@
-from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 3
-    page_query_param = 'page_size'
+    page_size_query_param = 'page_size'
     max_page_size = 10
+
+
+class KeysetPagination(CursorPagination):
+    """ Пагинация по ключу: глубокие страницы стоят столько же, сколько первая, и не требуют COUNT(*) """
+
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = settings.KEYSET_PAGINATION_MAX_PAGE_SIZE
+    ordering = 'id'
+
+
+class KeysetPaginationMixin:
+    """ Включает пагинацию по ключу параметром ?pagination=cursor или настройкой KEYSET_PAGINATION_DEFAULT """
+
+    keyset_pagination_class = KeysetPagination
+    keyset_query_param = 'pagination'
+
+    def use_keyset_pagination(self):
+        mode = self.request.query_params.get(self.keyset_query_param)
+        if mode is None:
+            return settings.KEYSET_PAGINATION_DEFAULT
+        return mode == 'cursor'
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.use_keyset_pagination():
+                self._paginator = self.keyset_pagination_class()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
@@ -0,0 +1,174 @@
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, Value
+
+from lms.models import Course, Lesson
+
+SEARCH_MODELS = {'course': Course, 'lesson': Lesson}
+SEARCH_TEXT_FIELDS = ('title', 'description')
+SEARCH_FIELDS = ('id', *SEARCH_TEXT_FIELDS)
+# Вес совпадения в названии и описании для индекса в памяти, повторяет веса A и B у PostgreSQL
+FALLBACK_WEIGHTS = {'title': 1.0, 'description': 0.4}
+
+
+def uses_postgres_search():
+    return connection.vendor == 'postgresql'
+
+
+def get_search_vector():
+    return SearchVector('title', weight='A', config=settings.SEARCH_CONFIG) + \
+        SearchVector('description', weight='B', config=settings.SEARCH_CONFIG)
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+class InvertedIndex:
+    """ Инвертированный индекс в памяти процесса для баз без полнотекстового поиска (SQLite в разработке и тестах).
+
+    Строится из базы при первом поиске, дальше обновляется сигналами сохранения и удаления.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.built = False
+
+    def build(self):
+        with self.lock:
+            if self.built:
+                return
+            for kind, model in SEARCH_MODELS.items():
+                for row in model.objects.values(*SEARCH_FIELDS).iterator():
+                    self._add(kind, row)
+            self.built = True
+
+    def _add(self, kind, row):
+        key = (kind, row['id'])
+        self._remove(key)
+        weights = defaultdict(float)
+        for field, weight in FALLBACK_WEIGHTS.items():
+            for term in tokenize(row[field]):
+                weights[term] += weight
+        for term, weight in weights.items():
+            self.postings[term][key] = weight
+        self.documents[key] = tuple(weights)
+
+    def _remove(self, key):
+        for term in self.documents.pop(key, ()):
+            self.postings[term].pop(key, None)
+
+    def update(self, kind, rows):
+        # Пока индекс не построен, его соберут из базы при первом поиске
+        if not self.built:
+            return
+        with self.lock:
+            for row in rows:
+                self._add(kind, row)
+
+    def remove(self, kind, ids):
+        if not self.built:
+            return
+        with self.lock:
+            for pk in ids:
+                self._remove((kind, pk))
+
+    def search(self, text, kinds):
+        """ Возвращает [(тип, id, ранг)] документов, содержащих все слова запроса """
+
+        self.build()
+        terms = set(tokenize(text))
+        if not terms:
+            return []
+        with self.lock:
+            postings = sorted((self.postings.get(term, {}) for term in terms), key=len)
+            scores = {
+                key: sum(posting[key] for posting in postings)
+                for key in postings[0] if key[0] in kinds and all(key in posting for posting in postings[1:])
+            }
+        return sorted(((kind, pk, rank) for (kind, pk), rank in scores.items()), key=lambda item: (-item[2], item[:2]))
+
+
+fallback_index = InvertedIndex()
+
+
+class RankedResults:
+    """ Ранжированные результаты индекса в памяти, строки из базы читаются только для запрошенной страницы """
+
+    def __init__(self, hits, querysets):
+        self.hits = self.filter_visible(hits, querysets)
+
+    @staticmethod
+    def filter_visible(hits, querysets):
+        """ Оставляет только документы, которые есть в переданных выборках, одним запросом на модель """
+
+        visible = {
+            kind: set(queryset.filter(pk__in=[pk for hit_kind, pk, _ in hits if hit_kind == kind])
+                      .values_list('pk', flat=True))
+            for kind, queryset in querysets.items()
+        }
+        return [hit for hit in hits if hit[1] in visible[hit[0]]]
+
+    def __len__(self):
+        return len(self.hits)
+
+    def count(self):
+        return len(self.hits)
+
+    def __getitem__(self, item):
+        hits = self.hits[item] if isinstance(item, slice) else [self.hits[item]]
+        rows = {}
+        for kind, model in SEARCH_MODELS.items():
+            ids = [pk for hit_kind, pk, _ in hits if hit_kind == kind]
+            if ids:
+                rows[kind] = {row['id']: row for row in model.objects.filter(pk__in=ids).values(*SEARCH_FIELDS)}
+        # Строки, удаленные без сигналов, пропускаем
+        results = [
+            {'kind': kind, **rows[kind][pk], 'rank': rank}
+            for kind, pk, rank in hits if pk in rows.get(kind, {})
+        ]
+        return results if isinstance(item, slice) else results[0]
+
+
+def search(text, querysets=None):
+    """ Ищет курсы и уроки по названию и описанию, результаты отсортированы по рангу.
+
+    querysets задает выборку для каждого типа документов, например с учетом прав пользователя.
+    """
+
+    querysets = querysets or {kind: model.objects.all() for kind, model in SEARCH_MODELS.items()}
+    if not uses_postgres_search():
+        return RankedResults(fallback_index.search(text, list(querysets)), querysets)
+
+    query = SearchQuery(text, search_type='websearch', config=settings.SEARCH_CONFIG)
+    querysets = [
+        queryset.filter(search_vector=query)
+        .annotate(kind=Value(kind), rank=SearchRank(F('search_vector'), query))
+        .values('kind', *SEARCH_FIELDS, 'rank')
+        for kind, queryset in querysets.items()
+    ]
+    if len(querysets) == 1:
+        return querysets[0].order_by('-rank', 'id')
+    return querysets[0].union(*querysets[1:], all=True).order_by('-rank', 'kind', 'id')
+
+
+def update_search_index(model, objects):
+    """ Обновляет поисковый вектор только у переданных объектов """
+
+    kind = model._meta.model_name
+    if uses_postgres_search():
+        model.objects.filter(pk__in=[obj.pk for obj in objects]).update(search_vector=get_search_vector())
+    else:
+        fallback_index.update(kind, [{field: getattr(obj, field) for field in SEARCH_FIELDS} for obj in objects])
+
+
+def remove_from_search_index(model, ids):
+    if not uses_postgres_search():
+        fallback_index.remove(model._meta.model_name, ids)
@@ -1,30 +1,128 @@
-from rest_framework.serializers import ModelSerializer
+from django.conf import settings
+from rest_framework.serializers import CharField, ChoiceField, FloatField, IntegerField, ListField, ListSerializer, \
+    ModelSerializer, PrimaryKeyRelatedField, Serializer, ValidationError
 from rest_framework.fields import SerializerMethodField
-from lms.models import Course, Lesson
+from lms.models import Course, Lesson, Subscription
 from lms.validators import validate_links
+from users.services import get_entitlements, has_entitlement, is_course_purchased, is_lesson_purchased
+
+
+def get_context_entitlements(context):
+    """ Права пользователя запрашиваются один раз на весь ответ, включая вложенные сериализаторы """
+
+    if 'entitlements' not in context:
+        context['entitlements'] = get_entitlements(context['request'].user.pk)
+    return context['entitlements']
 
 
 class LessonSerializer(ModelSerializer):
+    is_purchased = SerializerMethodField()
+
     class Meta:
         model = Lesson
-        fields = '__all__'
+        exclude = ('search_vector',)
         validators = [validate_links]
 
+    def get_is_purchased(self, obj):
+        return is_lesson_purchased(get_context_entitlements(self.context), obj.pk, obj.course_id)
+
 
 class CourseSerializer(ModelSerializer):
-    lessons_count = SerializerMethodField()
     lessons = LessonSerializer(many=True, source='lesson_set', read_only=True)
     is_subscribed = SerializerMethodField()
+    is_purchased = SerializerMethodField()
 
     class Meta:
         model = Course
-        fields = '__all__'
-
-    def get_lessons_count(self, obj):
-        return obj.lesson_set.count()
+        exclude = ('subscribers_count', 'search_vector')
+        read_only_fields = ('lessons_count',)
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        return obj.subscriptions.filter(user=user).exists()
+        # Значение аннотируется в CourseViewSet.get_queryset, без аннотации берем его из прав пользователя
+        if hasattr(obj, 'annotated_is_subscribed'):
+            return obj.annotated_is_subscribed
+        return has_entitlement(get_context_entitlements(self.context)['subscriptions'], obj.pk)
+
+    def get_is_purchased(self, obj):
+        return is_course_purchased(get_context_entitlements(self.context), obj.pk)
+
+
+class BulkCourseField(PrimaryKeyRelatedField):
+    """ Берет курс из заранее загруженных LessonBulkListSerializer вместо запроса на каждый урок """
+
+    def to_internal_value(self, data):
+        courses = self.context.get('courses')
+        if courses is None:
+            return super().to_internal_value(data)
+        try:
+            return courses[int(data)]
+        except (KeyError, TypeError, ValueError):
+            self.fail('does_not_exist', pk_value=data)
+
+
+class LessonBulkListSerializer(ListSerializer):
+    def validate_items(self, items):
+        """ Проверяет все уроки за один проход, возвращает валидные данные и ошибки по индексам """
+
+        course_ids = set()
+        for item in items:
+            if isinstance(item, dict) and str(item.get('course', '')).isdigit():
+                course_ids.add(int(item['course']))
+        self.context['courses'] = Course.objects.in_bulk(course_ids)
+
+        valid, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                valid.append((index, self.run_child_validation(item)))
+            except ValidationError as error:
+                errors.append({'index': index, 'errors': error.detail})
+        return valid, errors
+
+
+class LessonBulkSerializer(LessonSerializer):
+    course = BulkCourseField(queryset=Course.objects.all(), allow_null=True, required=False)
+
+    class Meta(LessonSerializer.Meta):
+        read_only_fields = ('owner',)
+        list_serializer_class = LessonBulkListSerializer
+
+
+class SubscribeSerializer(Serializer):
+    course_id = IntegerField(min_value=1)
+
+
+class SubscriptionBulkSerializer(Serializer):
+    course_ids = ListField(
+        child=IntegerField(min_value=1), allow_empty=False, max_length=settings.SUBSCRIPTION_BULK_MAX_ITEMS,
+    )
+
+    def validate_course_ids(self, value):
+        # Повторы убираем, сохраняя порядок, чтобы отчет совпадал с запросом
+        return list(dict.fromkeys(value))
+
+
+class SubscriptionCourseSerializer(ModelSerializer):
+    class Meta:
+        model = Course
+        fields = ('id', 'title', 'description', 'lessons_count')
+
+
+class SubscriptionSerializer(ModelSerializer):
+    course = SubscriptionCourseSerializer(read_only=True)
+
+    class Meta:
+        model = Subscription
+        fields = ('id', 'course', 'created_at')
+
+
+class SearchQuerySerializer(Serializer):
+    q = CharField(min_length=2, max_length=200)
+    type = ChoiceField(choices=('course', 'lesson'), required=False)
 
 
+class SearchResultSerializer(Serializer):
+    kind = CharField()
+    id = IntegerField()
+    title = CharField()
+    description = CharField(allow_null=True)
+    rank = FloatField()
@@ -0,0 +1,385 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hashlib import md5
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.timezone import now
+
+from lms.models import Course, Lesson, Subscription
+from users.permissions import is_moder
+from users.services import get_entitlements, get_paid_payments, has_entitlement, invalidate_entitlements, \
+    is_course_purchased, is_lesson_purchased
+
+subscription_signals_muted = ContextVar('subscription_signals_muted', default=False)
+
+CATALOG_VERSION_KEY = 'lms:catalog_version'
+
+
+def get_subscriptions_version_key(user_id):
+    return f'lms:subscriptions_version:{user_id}'
+
+
+def get_subscriptions_version(user_id):
+    """ Возвращает время последнего изменения подписок пользователя """
+
+    # При потере ключа версия создается заново, поэтому старые ETag перестают совпадать
+    return cache.get_or_set(get_subscriptions_version_key(user_id), now, None)
+
+
+def bump_subscriptions_version(user_id):
+    cache.set(get_subscriptions_version_key(user_id), now(), None)
+    invalidate_entitlements([user_id])
+
+
+def get_catalog_version():
+    """ Возвращает время последнего удаления курса: удаление не отражается в max(updated_at) оставшихся курсов """
+
+    return cache.get_or_set(CATALOG_VERSION_KEY, now, None)
+
+
+def bump_catalog_version():
+    cache.set(CATALOG_VERSION_KEY, now(), None)
+
+
+def has_full_access(user):
+    return user.is_superuser or is_moder(user)
+
+
+def get_visible_courses(user, queryset=None):
+    """ Курсы, доступные пользователю: свои, с подпиской и оплаченные; модераторам доступны все.
+
+    Доступ проверяется в том же запросе, что и выборка, через Exists, без проверки каждого объекта.
+    Кеш прав для этого не используется: он нужен только для признаков is_subscribed и is_purchased.
+    """
+
+    queryset = Course.objects.all() if queryset is None else queryset
+    if has_full_access(user):
+        return queryset
+    return queryset.filter(
+        Q(owner_id=user.pk)
+        | Q(Exists(Subscription.objects.filter(user_id=user.pk, course=OuterRef('pk'))))
+        | Q(Exists(get_paid_payments(user.pk).filter(paid_course=OuterRef('pk'))))
+    )
+
+
+def get_visible_lessons(user, queryset=None):
+    """ Уроки, доступные пользователю: свои, из своих, подписанных или оплаченных курсов и оплаченные отдельно """
+
+    queryset = Lesson.objects.all() if queryset is None else queryset
+    if has_full_access(user):
+        return queryset
+    payments = get_paid_payments(user.pk)
+    return queryset.filter(
+        Q(owner_id=user.pk)
+        | Q(course__owner_id=user.pk)
+        | Q(Exists(Subscription.objects.filter(user_id=user.pk, course=OuterRef('course'))))
+        | Q(Exists(payments.filter(paid_course=OuterRef('course'))))
+        | Q(Exists(payments.filter(paid_lesson=OuterRef('pk'))))
+    )
+
+
+def get_course_cache_key(course_id):
+    return f'lms:course:{course_id}'
+
+
+def invalidate_courses(course_ids):
+    cache.delete_many([get_course_cache_key(course_id) for course_id in course_ids])
+
+
+def get_counter_expression(field, delta):
+    # Greatest не дает счетчику уйти в минус, если он успел разойтись с данными
+    return F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+
+
+def touch_courses(course_ids, **counters):
+    """ Обновляет updated_at и счетчики курсов, чтобы изменения уроков попадали в валидаторы и кеш курсов """
+
+    course_ids = {course_id for course_id in course_ids if course_id}
+    if course_ids:
+        updates = {field: get_counter_expression(field, delta) for field, delta in counters.items()}
+        Course.objects.filter(pk__in=course_ids).update(updated_at=now(), **updates)
+        invalidate_courses(course_ids)
+
+
+def touch_courses_with_lesson_deltas(deltas):
+    """ Обновляет курсы после массовой записи уроков, группируя курсы с одинаковым изменением счетчика """
+
+    courses_by_delta = defaultdict(list)
+    for course_id, delta in deltas.items():
+        courses_by_delta[delta].append(course_id)
+    for delta, course_ids in courses_by_delta.items():
+        if delta:
+            touch_courses(course_ids, lessons_count=delta)
+        else:
+            touch_courses(course_ids)
+
+
+def change_subscribers_count(course_id, delta):
+    """ Атомарно меняет счетчик подписчиков курса """
+
+    Course.objects.filter(pk=course_id).update(subscribers_count=get_counter_expression('subscribers_count', delta))
+
+
+# На PostgreSQL вставка или удаление подписки и изменение счетчика курса выполняются одним запросом через
+# изменяющий CTE. Сигналы подписок при этом не вызываются, поэтому версию подписок обновляет вызывающий код.
+SUBSCRIBE_SQL = f"""
+    WITH inserted AS (
+        INSERT INTO {Subscription._meta.db_table} (user_id, course_id, created_at)
+        SELECT %s, id, %s FROM {Course._meta.db_table} WHERE id = %s
+        ON CONFLICT (user_id, course_id) DO NOTHING
+        RETURNING course_id
+    )
+    UPDATE {Course._meta.db_table} SET subscribers_count = subscribers_count + 1
+    WHERE id IN (SELECT course_id FROM inserted)
+"""
+UNSUBSCRIBE_SQL = f"""
+    WITH deleted AS (
+        DELETE FROM {Subscription._meta.db_table} WHERE user_id = %s AND course_id = %s
+        RETURNING course_id
+    )
+    UPDATE {Course._meta.db_table} SET subscribers_count = GREATEST(subscribers_count - 1, 0)
+    WHERE id IN (SELECT course_id FROM deleted)
+"""
+# Без изменяющих CTE (SQLite в разработке и тестах) счетчик обновляется вторым запросом
+INSERT_SUBSCRIPTION_SQL = f"""
+    INSERT INTO {Subscription._meta.db_table} (user_id, course_id, created_at)
+    SELECT %s, id, %s FROM {Course._meta.db_table} WHERE id = %s
+    ON CONFLICT (user_id, course_id) DO NOTHING
+"""
+DELETE_SUBSCRIPTION_SQL = f"DELETE FROM {Subscription._meta.db_table} WHERE user_id = %s AND course_id = %s"
+
+
+def execute_subscription_change(sql, fallback_sql, params, course_id, delta):
+    """ Выполняет вставку или удаление подписки вместе с изменением счетчика, возвращает True, если строка менялась """
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(sql, params)
+            return cursor.rowcount > 0
+        cursor.execute(fallback_sql, params)
+        changed = cursor.rowcount > 0
+    if changed:
+        change_subscribers_count(course_id, delta)
+    return changed
+
+
+def subscribe(user, course_id):
+    """ Создает подписку одним INSERT ... ON CONFLICT DO NOTHING вместе со счетчиком курса.
+
+    Возвращает False, если подписка уже есть или курса не существует.
+    """
+
+    # Повторную подписку из параллельного запроса отсекает уникальное ограничение, а не предварительная проверка
+    created = execute_subscription_change(
+        SUBSCRIBE_SQL, INSERT_SUBSCRIPTION_SQL, [user.pk, now(), course_id], course_id, 1,
+    )
+    if created:
+        bump_subscriptions_version(user.pk)
+    return created
+
+
+def unsubscribe(user, course_id):
+    """ Удаляет подписку одним DELETE вместе со счетчиком курса, возвращает False, если ее не было """
+
+    deleted = execute_subscription_change(
+        UNSUBSCRIBE_SQL, DELETE_SUBSCRIPTION_SQL, [user.pk, course_id], course_id, -1,
+    )
+    if deleted:
+        bump_subscriptions_version(user.pk)
+    return deleted
+
+
+@contextmanager
+def mute_subscription_signals():
+    """ Отключает обработчики сигналов подписок, когда счетчики и версии обновляются одним запросом """
+
+    token = subscription_signals_muted.set(True)
+    try:
+        yield
+    finally:
+        subscription_signals_muted.reset(token)
+
+
+def insert_subscriptions(user, course_ids):
+    """ Вставляет подписки одной пачкой и возвращает курсы, подписки на которые действительно созданы.
+
+    Если параллельный запрос успел подписать пользователя на один из курсов, пачка откатывается до точки
+    сохранения и подписки вставляются по одной, чтобы не засчитать чужую вставку.
+    """
+
+    # bulk_create не вызывает сигналы, поэтому счетчики обновляет вызывающий код
+    try:
+        with transaction.atomic():
+            Subscription.objects.bulk_create(
+                [Subscription(user=user, course_id=course_id) for course_id in course_ids]
+            )
+        return course_ids
+    except IntegrityError:
+        pass
+
+    created = []
+    for course_id in course_ids:
+        try:
+            with transaction.atomic():
+                Subscription.objects.bulk_create([Subscription(user=user, course_id=course_id)])
+        except IntegrityError:
+            continue
+        created.append(course_id)
+    return created
+
+
+def bulk_subscribe(user, course_ids):
+    """ Подписывает на курсы: одно чтение, один INSERT и одно обновление счетчиков на всю пачку """
+
+    course_ids = list(dict.fromkeys(course_ids))
+    with transaction.atomic():
+        found = dict(
+            Course.objects.filter(pk__in=course_ids).annotate(
+                subscribed=Exists(Subscription.objects.filter(user=user, course=OuterRef('pk')))
+            ).values_list('pk', 'subscribed')
+        )
+        missing = [course_id for course_id in course_ids if course_id in found and not found[course_id]]
+        created = insert_subscriptions(user, missing) if missing else []
+        if created:
+            Course.objects.filter(pk__in=created).update(
+                subscribers_count=get_counter_expression('subscribers_count', 1)
+            )
+    if created:
+        bump_subscriptions_version(user.pk)
+    return {
+        'subscribed': created,
+        'already_subscribed': [
+            course_id for course_id in course_ids if course_id in found and course_id not in created
+        ],
+        'not_found': [course_id for course_id in course_ids if course_id not in found],
+    }
+
+
+def bulk_unsubscribe(user, course_ids):
+    """ Отписывает от курсов одним DELETE и одним обновлением счетчиков """
+
+    course_ids = list(dict.fromkeys(course_ids))
+    with transaction.atomic():
+        subscriptions = Subscription.objects.filter(user=user, course_id__in=course_ids)
+        removed = set(subscriptions.select_for_update().values_list('course_id', flat=True))
+        if removed:
+            with mute_subscription_signals():
+                subscriptions.delete()
+            Course.objects.filter(pk__in=removed).update(
+                subscribers_count=get_counter_expression('subscribers_count', -1)
+            )
+    if removed:
+        bump_subscriptions_version(user.pk)
+    return {
+        'unsubscribed': [course_id for course_id in course_ids if course_id in removed],
+        'not_subscribed': [course_id for course_id in course_ids if course_id not in removed],
+    }
+
+
+def recount_course_counters():
+    """ Пересчитывает счетчики уроков и подписчиков у разошедшихся курсов, возвращает их количество """
+
+    lessons = Lesson.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(
+        total=Count('pk')).values('total')
+    subscribers = Subscription.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(
+        total=Count('pk')).values('total')
+    actual = {
+        'lessons_count': Coalesce(Subquery(lessons), 0),
+        'subscribers_count': Coalesce(Subquery(subscribers), 0),
+    }
+
+    drifted_ids = list(
+        Course.objects.annotate(actual_lessons=actual['lessons_count'], actual_subscribers=actual['subscribers_count'])
+        .exclude(lessons_count=F('actual_lessons'), subscribers_count=F('actual_subscribers'))
+        .values_list('pk', flat=True)
+    )
+    if drifted_ids:
+        Course.objects.filter(pk__in=drifted_ids).update(**actual)
+        invalidate_courses(drifted_ids)
+    return len(drifted_ids)
+
+
+def get_course_bodies(course_ids, serialize):
+    """ Возвращает общие для всех пользователей данные курсов из кеша, сериализуя только отсутствующие """
+
+    keys = {course_id: get_course_cache_key(course_id) for course_id in course_ids}
+    cached = cache.get_many(keys.values())
+    bodies = {course_id: cached[key] for course_id, key in keys.items() if key in cached}
+
+    missing = [course_id for course_id in course_ids if course_id not in bodies]
+    if missing:
+        fresh = serialize(missing)
+        cache.set_many(
+            {get_course_cache_key(course_id): body for course_id, body in fresh.items()},
+            settings.COURSE_CACHE_TIMEOUT,
+        )
+        bodies.update(fresh)
+    return [bodies[course_id] for course_id in course_ids if course_id in bodies]
+
+
+async def aget_course_bodies(course_ids, serialize):
+    """ Асинхронный вариант get_course_bodies: кеш читается без потока, сериализуются только промахи """
+
+    keys = {course_id: get_course_cache_key(course_id) for course_id in course_ids}
+    cached = await cache.aget_many(keys.values())
+    bodies = {course_id: cached[key] for course_id, key in keys.items() if key in cached}
+
+    missing = [course_id for course_id in course_ids if course_id not in bodies]
+    if missing:
+        fresh = await sync_to_async(serialize)(missing)
+        await cache.aset_many(
+            {get_course_cache_key(course_id): body for course_id, body in fresh.items()},
+            settings.COURSE_CACHE_TIMEOUT,
+        )
+        bodies.update(fresh)
+    return [bodies[course_id] for course_id in course_ids if course_id in bodies]
+
+
+def strip_user_flags(body):
+    """ Убирает из данных курса персональные признаки, чтобы их можно было положить в общий кеш """
+
+    body.pop('is_subscribed')
+    body.pop('is_purchased')
+    for lesson in body['lessons']:
+        lesson.pop('is_purchased')
+    return body
+
+
+def add_user_flags(bodies, entitlements):
+    """ Дополняет общие данные курсов признаками подписки и покупки по правам пользователя, без запросов """
+
+    return [
+        {
+            **body,
+            'lessons': [
+                {**lesson, 'is_purchased': is_lesson_purchased(entitlements, lesson['id'], lesson['course'])}
+                for lesson in body['lessons']
+            ],
+            'is_subscribed': has_entitlement(entitlements['subscriptions'], body['id']),
+            'is_purchased': is_course_purchased(entitlements, body['id']),
+        }
+        for body in bodies
+    ]
+
+
+def get_courses_validators(queryset, user, key):
+    """ Возвращает ETag и Last-Modified для выборки курсов одним агрегирующим запросом """
+
+    validators = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+    if not validators['count']:
+        return None, None
+
+    subscriptions_version = get_subscriptions_version(user.pk)
+    last_modified = max(validators['last_modified'], subscriptions_version, get_catalog_version())
+    # Права входят в ETag, чтобы оплата меняла is_purchased в ответе, даже если список курсов остался прежним
+    etag = md5(
+        f"{key}:{user.pk}:{validators['last_modified'].isoformat()}:{validators['count']}:"
+        f"{subscriptions_version.isoformat()}:{get_entitlements(user.pk)}".encode()
+    ).hexdigest()
+    return etag, last_modified
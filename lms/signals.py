@@ -0,0 +1,83 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from lms.models import Course, Lesson, Subscription
+from lms.search import SEARCH_TEXT_FIELDS, remove_from_search_index, update_search_index
+from lms.services import bump_catalog_version, bump_subscriptions_version, change_subscribers_count, \
+    invalidate_courses, subscription_signals_muted, touch_courses
+
+
+@receiver([post_save, post_delete], sender=Course)
+def invalidate_course_cache(sender, instance, **kwargs):
+    invalidate_courses([instance.pk])
+
+
+@receiver(post_delete, sender=Course)
+def update_deleted_course_catalog(sender, instance, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Lesson)
+def update_search_vector(sender, instance, update_fields=None, **kwargs):
+    # Вектор пересчитывается только у сохраненной строки и только если менялся текст
+    if update_fields is None or set(update_fields) & set(SEARCH_TEXT_FIELDS):
+        update_search_index(sender, [instance])
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Lesson)
+def remove_search_document(sender, instance, **kwargs):
+    remove_from_search_index(sender, [instance.pk])
+
+
+@receiver(post_init, sender=Lesson)
+def remember_lesson_course(sender, instance, **kwargs):
+    # Читаем из __dict__, чтобы не подгружать отложенное поле отдельным запросом
+    instance._initial_course_id = instance.__dict__.get('course_id')
+
+
+@receiver(post_save, sender=Lesson)
+def update_lesson_courses(sender, instance, created, **kwargs):
+    """ Изменение урока меняет updated_at его курса, а создание и перенос еще и счетчики уроков.
+
+    course.lesson_set.add, remove и clear с bulk=True пишут уроки одним UPDATE без post_save, поэтому
+    счетчики курсов в коде меняются через сохранение уроков или bulk=False, а расхождения после массовых
+    операций исправляет команда recount_course_counters.
+    """
+
+    initial_course_id = getattr(instance, '_initial_course_id', None)
+    if created:
+        touch_courses([instance.course_id], lessons_count=1)
+    elif initial_course_id != instance.course_id:
+        touch_courses([initial_course_id], lessons_count=-1)
+        touch_courses([instance.course_id], lessons_count=1)
+    else:
+        touch_courses([instance.course_id])
+    instance._initial_course_id = instance.course_id
+
+
+@receiver(post_delete, sender=Lesson)
+def update_deleted_lesson_course(sender, instance, **kwargs):
+    touch_courses([instance.course_id], lessons_count=-1)
+
+
+@receiver(post_save, sender=Subscription)
+def update_created_subscription(sender, instance, created, **kwargs):
+    """ Подписка влияет только на is_subscribed, который не кешируется вместе с курсом """
+
+    if subscription_signals_muted.get():
+        return
+    if created:
+        change_subscribers_count(instance.course_id, 1)
+    bump_subscriptions_version(instance.user_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def update_deleted_subscription(sender, instance, origin=None, **kwargs):
+    if subscription_signals_muted.get():
+        return
+    # При удалении самого курса счетчик обновлять уже незачем
+    if not (isinstance(origin, Course) and origin.pk == instance.course_id):
+        change_subscribers_count(instance.course_id, -1)
+    bump_subscriptions_version(instance.user_id)
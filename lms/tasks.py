@@ -1,14 +1,75 @@
+import logging
+from itertools import islice
+
 from celery import shared_task
-from django.core.mail import send_mail
+from django.conf import settings
+from django.core.mail import get_connection, send_mail, send_mass_mail
+
+from lms.models import Subscription
+
+logger = logging.getLogger(__name__)
+
+COURSE_UPDATE_SUBJECT = 'Обновление материала курса'
+COURSE_UPDATE_FROM_EMAIL = 'mishael000@yandex.ru'
 
 
 @shared_task
 def send_course_update_email(course_id, subscriber_email):
     send_mail(
-        'Обновление материала курса',
+        COURSE_UPDATE_SUBJECT,
         f'Материалы курса {course_id} обновлены',
-        'mishael000@yandex.ru',
+        COURSE_UPDATE_FROM_EMAIL,
         [subscriber_email]
     )
 
 
+def add_chunk_report(report, number, size, sent, error=None):
+    report['sent'] += sent
+    report['failed'] += size - sent
+    report['chunks'].append({'chunk': number, 'size': size, 'sent': sent, 'error': error})
+
+
+@shared_task
+def send_course_update_notifications(course_id, chunk_size=None):
+    """ Рассылает уведомление об обновлении курса всем подписчикам пачками через одно соединение """
+
+    chunk_size = chunk_size or settings.COURSE_UPDATE_EMAIL_CHUNK_SIZE
+    message = f'Материалы курса {course_id} обновлены'
+    emails = (
+        Subscription.objects.filter(course_id=course_id)
+        .order_by('pk')
+        .values_list('user__email', flat=True)
+        .iterator(chunk_size=chunk_size)
+    )
+    chunks = enumerate(iter(lambda: list(islice(emails, chunk_size)), []), start=1)
+
+    report = {'course_id': course_id, 'sent': 0, 'failed': 0, 'chunks': []}
+    connection = get_connection()
+    try:
+        for number, chunk in chunks:
+            datatuple = [(COURSE_UPDATE_SUBJECT, message, COURSE_UPDATE_FROM_EMAIL, [email]) for email in chunk]
+            try:
+                if number == 1:
+                    # Соединение открываем, только когда есть подписчики, и держим его на все пачки,
+                    # чтобы send_mass_mail не переподключался на каждую пачку
+                    connection.open()
+                sent = send_mass_mail(datatuple, connection=connection)
+            except Exception as error:
+                logger.exception('Курс %s: не удалось отправить пачку %s из %s писем', course_id, number, len(chunk))
+                add_chunk_report(report, number, len(chunk), 0, str(error))
+                try:
+                    connection.close()
+                    connection.open()
+                except Exception as error:
+                    # Почтовый сервер недоступен: оставшиеся пачки не отправляем, а отмечаем в отчете
+                    logger.exception('Курс %s: не удалось переподключиться к почтовому серверу', course_id)
+                    for number, chunk in chunks:
+                        add_chunk_report(report, number, len(chunk), 0, str(error))
+                    break
+                continue
+            add_chunk_report(report, number, len(chunk), sent)
+    finally:
+        connection.close()
+
+    logger.info('Курс %s: отправлено %s уведомлений, ошибок %s', course_id, report['sent'], report['failed'])
+    return report
@@ -1,19 +1,41 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils.timezone import now
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework import status
-from users.models import User
+
+from config.middleware import RequestProfilingMiddleware, profiles
+from users.models import Payment, User
+from .benchmark import run_async_comparison
 from .models import Course, Lesson, Subscription
+from .services import bulk_subscribe, subscribe
+from .tasks import send_course_update_notifications
 
 
 class CourseTestCase(APITestCase):
     def setUp(self):
         """ Создание пользователя, курса, урока и добавление урока в курс """
 
+        cache.clear()
         self.user = User.objects.create(email="user@example.com")
         self.client.force_authenticate(user=self.user)
-        self.course = Course.objects.create(title="Test Course")
-        self.lesson = Lesson.objects.create(title='Test Lesson')
-        self.course.lesson_set.add(self.lesson)
+        self.course = Course.objects.create(title="Test Course", owner=self.user)
+        self.lesson = Lesson.objects.create(title='Test Lesson', owner=self.user)
+        self.course.lesson_set.add(self.lesson, bulk=False)
 
     def test_create_course(self):
         """ Тестирование добавления курса """
@@ -64,15 +86,261 @@ class CourseTestCase(APITestCase):
         self.assertEqual(Course.objects.all().count(), 0)
 
 
+class CourseQueriesTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователя и курсов с уроками и подписками """
+
+        cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        self.client.force_authenticate(user=self.user)
+        for number in range(3):
+            course = Course.objects.create(title=f"Course {number}", owner=self.user)
+            Lesson.objects.create(title=f"Lesson {number}-1", course=course, owner=self.user)
+            Lesson.objects.create(title=f"Lesson {number}-2", course=course, owner=self.user)
+        Subscription.objects.create(user=self.user, course=course)
+
+    def test_list_courses_num_queries(self):
+        """ Количество запросов на страницу курсов не зависит от числа курсов """
+
+        url = reverse('lms:course-list')
+        # членство в модераторах, права пользователя, валидаторы ETag, count, id страницы, курсы с аннотациями,
+        # уроки одним prefetch-запросом
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual([course['lessons_count'] for course in results], [2, 2, 2])
+        self.assertEqual([course['is_subscribed'] for course in results], [False, False, True])
+        self.assertEqual(len(results[0]['lessons']), 2)
+
+    def test_list_courses_cached(self):
+        """ Повторный запрос берет курсы из кеша, а подписку определяет отдельно для пользователя """
+
+        url = reverse('lms:course-list')
+        self.client.get(url)
+
+        other_user = User.objects.create(email="other@example.com")
+        for course in Course.objects.all():
+            Payment.objects.create(
+                user=other_user, paid_course=course, amount=100, payment_method='cash', status=Payment.STATUS_PAID
+            )
+        self.client.force_authenticate(user=other_user)
+        # членство в модераторах, права пользователя, валидаторы ETag, count, id страницы
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+
+        results = response.json()['results']
+        self.assertEqual([course['lessons_count'] for course in results], [2, 2, 2])
+        self.assertEqual([course['is_subscribed'] for course in results], [False, False, False])
+
+    def test_retrieve_course_invalid_pk(self):
+        """ Нечисловой id курса дает 404, а не ошибку сервера """
+
+        response = self.client.get('/lms/abc/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_course_cache_invalidated(self):
+        """ Изменение курса и его уроков сбрасывает кеш курса """
+
+        course = Course.objects.first()
+        url = reverse('lms:course-detail', args=(course.pk,))
+        self.client.get(url)
+
+        course.title = "Updated Course"
+        course.save()
+        Lesson.objects.create(title="New Lesson", course=course, owner=self.user)
+        data = self.client.get(url).json()
+
+        self.assertEqual(data['title'], "Updated Course")
+        self.assertEqual(data['lessons_count'], 3)
+
+    def test_list_courses_keyset_num_queries(self):
+        """ Пагинация по ключу не выполняет COUNT(*) """
+
+        url = reverse('lms:course-list')
+        self.client.get(url, {'pagination': 'cursor', 'page_size': 2})
+        # валидаторы ETag и id страницы, подписки берутся из закешированных прав
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'pagination': 'cursor', 'page_size': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_retrieve_course_num_queries(self):
+        """ Количество запросов на отображение курса """
+
+        course = Course.objects.last()
+        url = reverse('lms:course-detail', args=(course.pk,))
+        self.client.get(url)
+        # валидаторы ETag и проверка прав, подписка берется из закешированных прав
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        data = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(data.get('lessons_count'), 2)
+        self.assertTrue(data.get('is_subscribed'))
+
+
+class CourseConditionalRequestTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователя, курса и урока """
+
+        cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(title="Test Course", owner=self.user)
+        self.lesson = Lesson.objects.create(title='Test Lesson', course=self.course, owner=self.user)
+        self.list_url = reverse('lms:course-list')
+        self.detail_url = reverse('lms:course-detail', args=(self.course.pk,))
+
+    def test_list_not_modified(self):
+        """ Повторный запрос списка с тем же ETag стоит одного агрегирующего запроса """
+
+        response = self.client.get(self.list_url)
+        etag = response.headers['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_course_delete_modifies_list(self):
+        """ Удаление курса сдвигает Last-Modified списка, хотя max(updated_at) оставшихся курсов не меняется """
+
+        Course.objects.create(title="Other Course", owner=self.user)
+        last_modified = self.client.get(self.list_url).headers['Last-Modified']
+
+        with mock.patch('lms.services.now', return_value=now() + timedelta(seconds=5)):
+            self.course.delete()
+
+        response = self.client.get(self.list_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_lesson_change_modifies_course(self):
+        """ Изменение урока меняет ETag курса """
+
+        etag = self.client.get(self.detail_url).headers['ETag']
+        self.lesson.title = 'Updated Lesson'
+        self.lesson.save()
+
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['lessons'][0]['title'], 'Updated Lesson')
+
+    def test_lesson_moved_modifies_previous_course(self):
+        """ Перенос урока в другой курс меняет ETag прежнего курса """
+
+        etag = self.client.get(self.detail_url).headers['ETag']
+        self.lesson.course = Course.objects.create(title="Other Course", owner=self.user)
+        self.lesson.save()
+
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['lessons_count'], 0)
+
+    def test_subscription_modifies_course(self):
+        """ Подписка меняет ETag, так как меняется is_subscribed """
+
+        etag = self.client.get(self.detail_url).headers['ETag']
+        self.client.post(reverse('lms:subscribe'), {"course_id": self.course.id})
+
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()['is_subscribed'])
+
+
+class CourseCountersTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователя и двух курсов """
+
+        cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(title="Test Course")
+        self.other_course = Course.objects.create(title="Other Course")
+
+    def assertCounters(self, course, lessons_count, subscribers_count):
+        course.refresh_from_db()
+        self.assertEqual((course.lessons_count, course.subscribers_count), (lessons_count, subscribers_count))
+
+    def test_lessons_count(self):
+        """ Счетчик уроков меняется при создании, переносе и удалении урока """
+
+        lesson = Lesson.objects.create(title='Test Lesson', course=self.course)
+        Lesson.objects.create(title='Second Lesson', course=self.course)
+        self.assertCounters(self.course, 2, 0)
+
+        lesson.course = self.other_course
+        lesson.save()
+        self.assertCounters(self.course, 1, 0)
+        self.assertCounters(self.other_course, 1, 0)
+
+        lesson.delete()
+        self.assertCounters(self.other_course, 0, 0)
+
+    def test_lessons_count_related_manager(self):
+        """ Счетчик уроков меняется при add, remove, set и clear через course.lesson_set с bulk=False """
+
+        lesson = Lesson.objects.create(title='Test Lesson')
+        second_lesson = Lesson.objects.create(title='Second Lesson', course=self.other_course)
+        self.course.lesson_set.add(lesson, second_lesson, bulk=False)
+        self.assertCounters(self.course, 2, 0)
+        self.assertCounters(self.other_course, 0, 0)
+
+        self.course.lesson_set.remove(lesson, bulk=False)
+        self.assertCounters(self.course, 1, 0)
+
+        self.other_course.lesson_set.set([lesson], bulk=False)
+        self.assertCounters(self.other_course, 1, 0)
+
+        self.course.lesson_set.clear(bulk=False)
+        self.assertCounters(self.course, 0, 0)
+        self.assertEqual(self.course.lesson_set.count(), 0)
+
+    def test_lessons_count_bulk_related_manager(self):
+        """ Массовый add через course.lesson_set обходит сигналы, счетчик исправляет recount_course_counters """
+
+        self.course.lesson_set.add(Lesson.objects.create(title='Test Lesson'))
+        self.assertCounters(self.course, 0, 0)
+
+        call_command('recount_course_counters', stdout=StringIO())
+        self.assertCounters(self.course, 1, 0)
+
+    def test_subscribers_count(self):
+        """ Счетчик подписчиков меняется при подписке и отписке """
+
+        url = reverse('lms:subscribe')
+        self.client.post(url, {"course_id": self.course.id})
+        self.assertCounters(self.course, 0, 1)
+
+        self.client.post(url, {"course_id": self.course.id})
+        self.assertCounters(self.course, 0, 0)
+
+    def test_recount_command(self):
+        """ Команда пересчета исправляет разошедшиеся счетчики """
+
+        Lesson.objects.create(title='Test Lesson', course=self.course)
+        Subscription.objects.create(user=self.user, course=self.course)
+        Course.objects.update(lessons_count=5, subscribers_count=0)
+
+        call_command('recount_course_counters', stdout=StringIO())
+        self.assertCounters(self.course, 1, 1)
+        self.assertCounters(self.other_course, 0, 0)
+
+
 class LessonTestsCase(APITestCase):
     def setUp(self):
         """ Создание пользователя, курса, урока и добавление урока в курс """
 
+        cache.clear()
         self.user = User.objects.create(email="user@example.com")
         self.client.force_authenticate(user=self.user)
-        self.course = Course.objects.create(title="Test Course")
-        self.lesson = Lesson.objects.create(title='Test Lesson')
-        self.course.lesson_set.add(self.lesson)
+        self.course = Course.objects.create(title="Test Course", owner=self.user)
+        self.lesson = Lesson.objects.create(title='Test Lesson', owner=self.user)
+        self.course.lesson_set.add(self.lesson, bulk=False)
 
     def test_create_lesson(self):
         """ Тестирование создания урока """
@@ -93,6 +361,26 @@ class LessonTestsCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertGreater(len(response.data), 0)
 
+    def test_list_lessons_keyset_pagination(self):
+        """ Тестирование пагинации уроков по ключу """
+
+        for number in range(4):
+            Lesson.objects.create(title=f'Lesson {number}', owner=self.user)
+        url = reverse('lms:lesson-list-create')
+        response = self.client.get(url, {'pagination': 'cursor', 'page_size': 3})
+        data = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), 3)
+
+        # Ссылка на следующую страницу сохраняет режим пагинации и размер страницы
+        with self.assertNumQueries(1):
+            response = self.client.get(data['next'])
+        data = response.json()
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNone(data['next'])
+
     def test_retrieve_lesson(self):
         """ Тестирование отображения урока """
 
@@ -122,15 +410,84 @@ class LessonTestsCase(APITestCase):
         self.assertEqual(Lesson.objects.count(), 0)
 
 
+class LessonBulkTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователя и курса """
+
+        cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(title="Test Course", owner=self.user)
+        self.url = reverse('lms:lesson-bulk')
+
+    def test_bulk_create(self):
+        """ Массовое создание уроков обновляет курс один раз """
+
+        data = [{"title": f"Lesson {number}", "course": self.course.pk} for number in range(20)]
+        # курсы одним запросом, затем вставка уроков и обновление курса внутри транзакции, права для is_purchased
+        with self.assertNumQueries(6):
+            response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.json()['lessons']), 20)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.lessons_count, 20)
+        self.assertEqual(Lesson.objects.filter(owner=self.user).count(), 20)
+
+    def test_bulk_create_atomic(self):
+        """ Ошибка в одном уроке отменяет всю пачку """
+
+        data = [{"title": "Lesson", "course": self.course.pk}, {"title": "Lesson", "course": 9999}]
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['errors'][0]['index'], 1)
+        self.assertEqual(Lesson.objects.count(), 0)
+
+    def test_bulk_create_allow_partial(self):
+        """ С allow_partial валидные уроки создаются, ошибки возвращаются по индексам """
+
+        data = [{"title": "Lesson", "course": self.course.pk}, {"course": self.course.pk}]
+        response = self.client.post(f'{self.url}?allow_partial=true', data, format='json')
+        data = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(data['lessons']), 1)
+        self.assertEqual([error['index'] for error in data['errors']], [1])
+        self.assertIn('title', data['errors'][0]['errors'])
+
+    def test_bulk_update(self):
+        """ Массовое обновление уроков с переносом в другой курс """
+
+        other_course = Course.objects.create(title="Other Course", owner=self.user)
+        lessons = [Lesson.objects.create(title=f"Lesson {number}", course=self.course) for number in range(3)]
+        data = [
+            {"id": lessons[0].pk, "title": "Updated Lesson"},
+            {"id": lessons[1].pk, "course": other_course.pk},
+            {"id": 9999, "title": "Missing Lesson"},
+        ]
+        response = self.client.patch(f'{self.url}?allow_partial=true', data, format='json')
+        data = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([error['index'] for error in data['errors']], [2])
+        lessons[0].refresh_from_db()
+        self.assertEqual(lessons[0].title, "Updated Lesson")
+        self.course.refresh_from_db()
+        other_course.refresh_from_db()
+        self.assertEqual((self.course.lessons_count, other_course.lessons_count), (2, 1))
+
+
 class SubscriptionViewTests(APITestCase):
     def setUp(self):
         """ Создание пользователя, курса, урока и добавление урока в курс """
 
+        cache.clear()
         self.user = User.objects.create(email="user@example.com")
         self.client.force_authenticate(user=self.user)
         self.course = Course.objects.create(title="Test Course")
         self.lesson = Lesson.objects.create(title='Test Lesson')
-        self.course.lesson_set.add(self.lesson)
+        self.course.lesson_set.add(self.lesson, bulk=False)
 
     def test_subscribe_to_course(self):
         """ Тестирование подписки """
@@ -166,3 +523,642 @@ class SubscriptionViewTests(APITestCase):
         data = {"course_id": 9999}
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_subscribe_put_is_idempotent(self):
+        """ PUT подписывает один раз, повторный запрос ничего не меняет """
+
+        url = reverse('lms:subscribe')
+        first = self.client.put(url, {"course_id": self.course.id})
+        second = self.client.put(url, {"course_id": self.course.id})
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(Subscription.objects.count(), 1)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.subscribers_count, 1)
+
+    def test_unsubscribe_delete_is_idempotent(self):
+        """ DELETE отписывает и не падает, если подписки уже нет """
+
+        url = reverse('lms:subscribe')
+        Subscription.objects.create(user=self.user, course=self.course)
+
+        for _ in range(2):
+            response = self.client.delete(url, {"course_id": self.course.id})
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_toggle_num_queries(self):
+        """ Переключение подписки не читает подписку заранее """
+
+        url = reverse('lms:subscribe')
+        # DELETE, INSERT ... ON CONFLICT DO NOTHING и счетчик курса; на PostgreSQL INSERT и счетчик идут одним запросом
+        with self.assertNumQueries(3):
+            self.client.post(url, {"course_id": self.course.id})
+        # DELETE и счетчик курса; на PostgreSQL это один запрос
+        with self.assertNumQueries(2):
+            self.client.post(url, {"course_id": self.course.id})
+
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.subscribers_count, 0)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_subscription_unique(self):
+        """ Уникальное ограничение не дает создать повторную подписку """
+
+        self.assertTrue(subscribe(self.user, self.course.id))
+        self.assertFalse(subscribe(self.user, self.course.id))
+        self.assertEqual(Subscription.objects.count(), 1)
+
+
+class SubscriptionBulkTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователя и трех курсов, на первый из которых он уже подписан """
+
+        cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        self.client.force_authenticate(user=self.user)
+        self.courses = [Course.objects.create(title=f"Course {number}") for number in range(3)]
+        Subscription.objects.create(user=self.user, course=self.courses[0])
+
+    def test_bulk_subscribe(self):
+        """ Массовая подписка разбирает курсы на новые, существующие и ненайденные за постоянное число запросов """
+
+        course_ids = [course.id for course in self.courses] + [9999]
+        with self.assertNumQueries(7):
+            # SAVEPOINT, курсы с признаком подписки, SAVEPOINT, INSERT, RELEASE, счетчики, RELEASE
+            response = self.client.post(reverse('lms:subscription-bulk'), {'course_ids': course_ids}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            'subscribed': course_ids[1:3],
+            'already_subscribed': course_ids[:1],
+            'not_found': [9999],
+        })
+        self.assertEqual(Subscription.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(list(Course.objects.order_by('pk').values_list('subscribers_count', flat=True)), [1, 1, 1])
+
+    def test_bulk_subscribe_concurrent_insert(self):
+        """ Подписка, вставленная параллельно между чтением и INSERT, не увеличивает счетчик второй раз """
+
+        bulk_create = Subscription.objects.bulk_create
+
+        def concurrent_bulk_create(objs, *args, **kwargs):
+            if not Subscription.objects.filter(user=self.user, course=self.courses[1]).exists():
+                Subscription.objects.create(user=self.user, course=self.courses[1])
+            return bulk_create(objs, *args, **kwargs)
+
+        course_ids = [self.courses[1].id, self.courses[2].id, self.courses[2].id]
+        with mock.patch.object(Subscription.objects, 'bulk_create', concurrent_bulk_create):
+            result = bulk_subscribe(self.user, course_ids)
+
+        self.assertEqual(result['subscribed'], [self.courses[2].id])
+        self.assertEqual(result['already_subscribed'], [self.courses[1].id])
+        self.assertEqual(Subscription.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(list(Course.objects.order_by('pk').values_list('subscribers_count', flat=True)), [1, 1, 1])
+
+    def test_bulk_unsubscribe(self):
+        """ Массовая отписка удаляет подписки и уменьшает счетчики курсов """
+
+        course_ids = [self.courses[0].id, self.courses[1].id]
+        response = self.client.delete(reverse('lms:subscription-bulk'), {'course_ids': course_ids}, format='json')
+
+        self.assertEqual(response.json(), {'unsubscribed': course_ids[:1], 'not_subscribed': course_ids[1:]})
+        self.assertFalse(Subscription.objects.exists())
+        self.courses[0].refresh_from_db()
+        self.assertEqual(self.courses[0].subscribers_count, 0)
+
+    def test_bulk_validation(self):
+        """ Пустой список курсов отклоняется """
+
+        response = self.client.post(reverse('lms:subscription-bulk'), {'course_ids': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_subscription_list(self):
+        """ Список подписок отдает только подписки текущего пользователя с данными курса """
+
+        other = User.objects.create(email="other@example.com")
+        Subscription.objects.create(user=other, course=self.courses[1])
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('lms:subscription-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['course']['title'], "Course 0")
+
+
+class CourseUpdateNotificationTests(APITestCase):
+    def setUp(self):
+        """ Создание курса и пяти подписчиков """
+
+        cache.clear()
+        self.course = Course.objects.create(title="Test Course")
+        for number in range(5):
+            user = User.objects.create(email=f"user{number}@example.com")
+            Subscription.objects.create(user=user, course=self.course)
+
+    def test_update_enqueues_single_task(self):
+        """ Обновление курса ставит в очередь одну задачу на весь курс """
+
+        user = User.objects.get(email="user0@example.com")
+        self.client.force_authenticate(user=user)
+        url = reverse('lms:course-detail', args=(self.course.pk,))
+        Course.objects.filter(pk=self.course.pk).update(updated_at=now() - timedelta(hours=5))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.patch(url, {"title": "Updated Course"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_notifications_sent_in_chunks(self):
+        """ Письма отправляются пачками, отчет содержит результат по каждой пачке """
+
+        report = send_course_update_notifications(self.course.pk, chunk_size=2)
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(report['sent'], 5)
+        self.assertEqual(report['failed'], 0)
+        self.assertEqual([chunk['size'] for chunk in report['chunks']], [2, 2, 1])
+
+    def test_no_connection_without_subscribers(self):
+        """ Без подписчиков соединение с почтовым сервером не открывается """
+
+        with mock.patch('lms.tasks.get_connection') as get_connection:
+            report = send_course_update_notifications(Course.objects.create(title="Empty Course").pk)
+
+        get_connection.return_value.open.assert_not_called()
+        self.assertEqual(report['chunks'], [])
+
+    def test_reconnect_failure_marks_remaining_chunks(self):
+        """ Если переподключиться не удалось, оставшиеся пачки отмечаются неотправленными без исключения """
+
+        with mock.patch('lms.tasks.get_connection') as get_connection, \
+                mock.patch('lms.tasks.send_mass_mail', side_effect=OSError('connection reset')):
+            get_connection.return_value.open.side_effect = [True, OSError('connection refused')]
+            with self.assertLogs('lms.tasks', 'ERROR'):
+                report = send_course_update_notifications(self.course.pk, chunk_size=2)
+
+        self.assertEqual(report['sent'], 0)
+        self.assertEqual(report['failed'], 5)
+        self.assertEqual(
+            [chunk['error'] for chunk in report['chunks']],
+            ['connection reset', 'connection refused', 'connection refused'],
+        )
+
+
+class ExportTestCase(APITestCase):
+    def setUp(self):
+        """ Создание администратора, курса и подписки """
+
+        self.user = User.objects.create(email="admin@example.com", is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(title="Test Course")
+        Subscription.objects.create(user=self.user, course=self.course)
+
+    def test_export_subscriptions_ndjson(self):
+        """ Выгрузка подписок в NDJSON отдается потоком """
+
+        url = reverse('lms:subscription-export')
+        response = self.client.get(url, {'export_format': 'ndjson'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows[0]['course__title'], "Test Course")
+        self.assertEqual(rows[0]['user__email'], "admin@example.com")
+
+    def test_export_date_filter(self):
+        """ Выгрузка фильтруется по диапазону дат """
+
+        url = reverse('lms:subscription-export')
+        response = self.client.get(url, {'date_to': '2000-01-01'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(lines, ['id,user_id,user__email,course_id,course__title,created_at'])
+
+    def test_export_command(self):
+        """ Команда выгрузки пишет CSV в stdout """
+
+        out = StringIO()
+        call_command('export_data', 'subscriptions', stdout=out, stderr=StringIO())
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+    def test_export_forbidden_for_regular_user(self):
+        """ Выгрузка недоступна обычному пользователю """
+
+        self.client.force_authenticate(user=User.objects.create(email="user@example.com"))
+        response = self.client.get(reverse('lms:subscription-export'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ImportCatalogTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователя и файла каталога со ссылками на старые идентификаторы """
+
+        cache.clear()
+        self.user = User.objects.create(email="student@example.com")
+        self.objects = [
+            {'model': 'lms.course', 'pk': 100, 'fields': {'title': "Imported Course", 'owner': self.user.pk}},
+            {'model': 'lms.lesson', 'pk': 200, 'fields': {'title': "Lesson 1", 'course': 100}},
+            {'model': 'lms.lesson', 'pk': 201, 'fields': {'title': "Lesson 2", 'course': 100}},
+            {'model': 'lms.subscription', 'pk': 300, 'fields': {'user': self.user.pk, 'course': 100}},
+            {'model': 'lms.subscription', 'pk': 301, 'fields': {'user': self.user.pk, 'course': 999}},
+            {'model': 'users.payment', 'pk': 400, 'fields': {
+                'user': self.user.pk, 'paid_lesson': 201, 'amount': '10.00',
+                'payment_date': '2020-01-01T00:00:00Z', 'payment_method': 'transfer',
+            }},
+            {'model': 'users.user', 'pk': 500, 'fields': {}},
+        ]
+        self.tmp = tempfile.NamedTemporaryFile('w', suffix='.json', encoding='utf-8', delete=False)
+        self.addCleanup(os.remove, self.tmp.name)
+
+    def run_import(self, content, *args):
+        with self.tmp as file:
+            file.write(content)
+        out = StringIO()
+        call_command('import_catalog', self.tmp.name, '--batch-size', '1', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_import_json_array(self):
+        """ Импорт JSON-массива переназначает внешние ключи и пересчитывает счетчики """
+
+        output = self.run_import(json.dumps(self.objects, indent=2))
+
+        course = Course.objects.get(title="Imported Course")
+        self.assertEqual(course.owner, self.user)
+        self.assertEqual(course.lessons_count, 2)
+        self.assertEqual(course.subscribers_count, 1)
+        self.assertEqual(set(Lesson.objects.values_list('course', flat=True)), {course.pk})
+        payment = Payment.objects.get()
+        self.assertEqual(payment.paid_lesson.title, "Lesson 2")
+        self.assertEqual(payment.payment_date.year, 2020)
+        self.assertIn('lms.subscription: пропущено 1', output)
+        self.assertIn('users.user: пропущено 1', output)
+
+    def test_import_ndjson(self):
+        """ NDJSON разбирается построчно с тем же результатом """
+
+        self.run_import('\n'.join(json.dumps(obj) for obj in self.objects), '--format', 'ndjson')
+
+        self.assertEqual(Lesson.objects.count(), 2)
+        self.assertEqual(Subscription.objects.count(), 1)
+
+    def test_references_outside_file(self):
+        """ Ссылка вне файла берется из базы, битая ссылка пропускает строку, повтор подписки не создается """
+
+        existing = Course.objects.create(title="Existing Course")
+        Subscription.objects.create(user=self.user, course=existing)
+        output = self.run_import(json.dumps([
+            {'model': 'lms.lesson', 'pk': 200, 'fields': {'title': "Existing Lesson", 'course': existing.pk}},
+            {'model': 'lms.lesson', 'pk': 201, 'fields': {'title': "Orphan Lesson", 'course': 999}},
+            {'model': 'lms.subscription', 'pk': 300, 'fields': {'user': self.user.pk, 'course': existing.pk}},
+        ]))
+
+        self.assertEqual(Lesson.objects.get().course, existing)
+        self.assertEqual(Subscription.objects.count(), 1)
+        self.assertIn('lms.lesson: создано 1', output)
+        self.assertIn('lms.lesson: пропущено 1', output)
+        self.assertNotIn('lms.subscription: создано', output)
+        self.assertIn('lms.subscription: пропущено 1', output)
+
+
+class BenchmarkTestCase(APITestCase):
+    def setUp(self):
+        """ Генерация небольшого набора данных для замеров """
+
+        cache.clear()
+        call_command(
+            'seed_benchmark', '--users', '4', '--courses', '3', '--lessons-per-course', '2',
+            '--subscriptions-per-user', '2', '--payments-per-user', '1', '--seed', '1', stdout=StringIO(),
+        )
+
+    def test_seed_benchmark(self):
+        """ Генератор создает связанные данные и пересчитывает счетчики курсов """
+
+        self.assertEqual(User.objects.count(), 4)
+        self.assertEqual(Lesson.objects.count(), 6)
+        self.assertEqual(Subscription.objects.count(), 8)
+        self.assertEqual(Payment.objects.count(), 4)
+        self.assertEqual(sum(Course.objects.values_list('subscribers_count', flat=True)), 8)
+
+    def test_run_benchmark_report(self):
+        """ Отчет содержит процентили задержек и число запросов, а подписки не меняются """
+
+        subscriptions = set(Subscription.objects.values_list('user', 'course'))
+        out = StringIO()
+        call_command('run_benchmark', '--iterations', '3', '--warmup', '0', stdout=out, stderr=StringIO())
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['results']), {
+            'course_list', 'course_detail', 'lesson_list', 'subscribe_toggle', 'user_list', 'payment_list',
+        })
+        self.assertEqual(report['results']['course_list']['status_codes'], {'200': 3})
+        self.assertIn('p95', report['results']['lesson_list']['latency_ms'])
+        self.assertGreater(report['results']['user_list']['queries']['max'], 0)
+        self.assertEqual(set(Subscription.objects.values_list('user', 'course')), subscriptions)
+
+
+@override_settings(REQUEST_PROFILING=True, REQUEST_PROFILING_SAMPLE_RATE=1.0)
+class RequestProfilingTestCase(APITestCase):
+    def setUp(self):
+        """ Создание администратора и курсов с уроками """
+
+        cache.clear()
+        profiles.clear()
+        self.user = User.objects.create(email="admin@example.com", is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        course = Course.objects.create(title="Test Course", owner=self.user)
+        Lesson.objects.create(title="Test Lesson", course=course, owner=self.user)
+
+    def test_server_timing_header(self):
+        """ Замеренный запрос получает заголовок Server-Timing с числом SQL-запросов """
+
+        response = self.client.get(reverse('lms:lesson-list-create'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    def test_profiles_endpoint(self):
+        """ Профили запросов доступны администратору через кольцевой буфер """
+
+        self.client.get(reverse('lms:lesson-list-create'))
+        response = self.client.get(reverse('request-profiles'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = response.json()['results'][0]
+        self.assertEqual(profile['path'], reverse('lms:lesson-list-create'))
+        self.assertGreater(profile['queries'], 0)
+
+    async def test_async_request(self):
+        """ Под ASGI middleware работает асинхронно и считает запросы асинхронного представления """
+
+        headers = {'Authorization': f'Bearer {await sync_to_async(AccessToken.for_user)(self.user)}'}
+        response = await self.async_client.get(reverse('lms:async-course-list'), headers=headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertEqual(profiles[-1]['path'], reverse('lms:async-course-list'))
+
+    def test_middleware_is_async_capable(self):
+        """ С асинхронным обработчиком middleware становится корутинной функцией и пропускает запросы вне выборки """
+
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = RequestProfilingMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with override_settings(REQUEST_PROFILING_SAMPLE_RATE=0.0):
+            response = async_to_sync(RequestProfilingMiddleware(get_response))(RequestFactory().get('/'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(REQUEST_PROFILING=False)
+    def test_profiling_disabled(self):
+        """ Без включенной настройки middleware не подключается """
+
+        response = self.client.get(reverse('lms:lesson-list-create'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class SearchTestCase(APITestCase):
+    def setUp(self):
+        """ Создание курсов и уроков с разными совпадениями в названии и описании """
+
+        cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(title="Python basics", description="Intro course", owner=self.user)
+        self.lesson = Lesson.objects.create(
+            title="Variables", description="Python variables", course=self.course, owner=self.user
+        )
+        Course.objects.create(title="Django", description="Web framework")
+
+    def test_search_ranks_title_matches_first(self):
+        """ Совпадение в названии ранжируется выше совпадения в описании """
+
+        response = self.client.get(reverse('lms:search'), {'q': 'python'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual([(item['kind'], item['id']) for item in results],
+                         [('course', self.course.id), ('lesson', self.lesson.id)])
+        self.assertGreater(results[0]['rank'], results[1]['rank'])
+
+    def test_search_index_updates_on_save(self):
+        """ Индекс обновляется при сохранении урока без полной перестройки """
+
+        self.client.get(reverse('lms:search'), {'q': 'python'})
+        self.lesson.title = "Loops"
+        self.lesson.description = "Cycles"
+        self.lesson.save()
+
+        response = self.client.get(reverse('lms:search'), {'q': 'loops', 'type': 'lesson'})
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.lesson.id])
+        response = self.client.get(reverse('lms:search'), {'q': 'python variables'})
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_search_requires_query(self):
+        """ Слишком короткий запрос отклоняется """
+
+        response = self.client.get(reverse('lms:search'), {'q': 'p'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncReadTestCase(TransactionTestCase):
+    def setUp(self):
+        """ Создание пользователя с JWT, курса с уроком и подписки """
+
+        cache.clear()
+        self.user = User.objects.create(email="user@example.com")
+        self.course = Course.objects.create(title="Test Course", owner=self.user)
+        self.lesson = Lesson.objects.create(title="Test Lesson", course=self.course, owner=self.user)
+        Subscription.objects.create(user=self.user, course=self.course)
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    async def test_async_course_list_matches_sync(self):
+        """ Асинхронный список курсов отдает те же данные, что и синхронный """
+
+        response = await self.async_client.get(reverse('lms:async-course-list'), headers=self.headers)
+        sync_response = await sync_to_async(self.client.get)(reverse('lms:course-list'), headers=self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), sync_response.json())
+        self.assertTrue(response.json()['results'][0]['is_subscribed'])
+
+    async def test_async_details(self):
+        """ Детальные эндпоинты курса и урока и 404 для несуществующих объектов """
+
+        response = await self.async_client.get(
+            reverse('lms:async-course-detail', args=[self.course.pk]), headers=self.headers
+        )
+        self.assertEqual(response.json()['lessons'][0]['title'], "Test Lesson")
+
+        response = await self.async_client.get(
+            reverse('lms:async-lesson-detail', args=[self.lesson.pk]), headers=self.headers
+        )
+        self.assertEqual(response.json()['title'], "Test Lesson")
+
+        response = await self.async_client.get(reverse('lms:async-lesson-detail', args=[9999]), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_async_lesson_list_pagination(self):
+        """ Список уроков пагинируется по правилам CustomPagination """
+
+        response = await self.async_client.get(reverse('lms:async-lesson-list'), {'page': 2}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = await self.async_client.get(reverse('lms:async-lesson-list'), headers=self.headers)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertIsNone(response.json()['next'])
+
+    async def test_async_requires_token(self):
+        """ Без токена асинхронные эндпоинты возвращают 401 """
+
+        response = await self.async_client.get(reverse('lms:async-course-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_async_comparison(self):
+        """ Сравнение пропускной способности возвращает запросы в секунду для обоих вариантов """
+
+        report = run_async_comparison(self.user, requests=4, concurrency=2)
+
+        self.assertEqual(set(report['results']), {'course_list', 'lesson_list', 'course_detail', 'lesson_detail'})
+        for result in report['results'].values():
+            self.assertEqual(result['sync']['errors'], 0)
+            self.assertEqual(result['async']['errors'], 0)
+            self.assertGreater(result['async']['requests_per_second'], 0)
+
+
+class AccessScopeTestCase(APITestCase):
+    def setUp(self):
+        """ Создание владельца, курса с уроками и пользователя без доступа """
+
+        cache.clear()
+        self.owner = User.objects.create(email="owner@example.com")
+        self.user = User.objects.create(email="user@example.com")
+        self.course = Course.objects.create(title="Closed Course", owner=self.owner)
+        self.lesson = Lesson.objects.create(title="Closed Lesson", course=self.course, owner=self.owner)
+        self.single_lesson = Lesson.objects.create(title="Single Lesson", owner=self.owner)
+        self.client.force_authenticate(user=self.user)
+
+    def get_visible_ids(self):
+        courses = self.client.get(reverse('lms:course-list')).json()['results']
+        lessons = self.client.get(reverse('lms:lesson-list-create')).json()['results']
+        return [course['id'] for course in courses], [lesson['id'] for lesson in lessons]
+
+    def test_stranger_sees_nothing(self):
+        """ Чужие курсы и уроки не попадают в списки и отдают 404 """
+
+        self.assertEqual(self.get_visible_ids(), ([], []))
+        response = self.client.get(reverse('lms:course-detail', args=[self.course.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('lms:lesson-detail', args=[self.lesson.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('lms:search'), {'q': 'closed'})
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_subscription_opens_course(self):
+        """ Подписка открывает курс и его уроки """
+
+        Subscription.objects.create(user=self.user, course=self.course)
+
+        self.assertEqual(self.get_visible_ids(), ([self.course.pk], [self.lesson.pk]))
+
+    def test_payments_open_access(self):
+        """ Оплата stripe дает доступ только после подтверждения, отдельно оплаченный урок виден без курса """
+
+        payment = Payment.objects.create(
+            user=self.user, paid_course=self.course, amount=100, payment_method='stripe'
+        )
+        Payment.objects.create(
+            user=self.user, paid_lesson=self.single_lesson, amount=10, payment_method='cash',
+            status=Payment.STATUS_PAID,
+        )
+        self.assertEqual(self.get_visible_ids(), ([], [self.single_lesson.pk]))
+
+        payment.status = Payment.STATUS_PAID
+        payment.save()
+        self.assertEqual(self.get_visible_ids(), ([self.course.pk], [self.lesson.pk, self.single_lesson.pk]))
+
+    @override_settings(STRIPE_CHECKOUT_ASYNC=True)
+    def test_own_payment_does_not_open_access(self):
+        """ Платеж наличными от самого пользователя не дает доступа, пока его не подтвердит персонал """
+
+        response = self.client.post(
+            reverse('users:payment-list-create'),
+            {'payment_method': 'cash', 'paid_course': self.course.pk, 'amount': 1},
+        )
+        self.assertEqual(response.json()['status'], Payment.STATUS_PENDING)
+        self.assertEqual(self.get_visible_ids(), ([], []))
+
+        stripe_payment = Payment.objects.create(
+            user=self.user, paid_lesson=self.single_lesson, amount=10, payment_method='stripe'
+        )
+        self.client.patch(reverse('users:payment-detail', args=[stripe_payment.pk]), {'payment_method': 'cash'})
+        stripe_payment.refresh_from_db()
+        self.assertEqual(stripe_payment.payment_method, 'stripe')
+        self.assertEqual(self.get_visible_ids(), ([], []))
+
+        response = self.client.post(reverse('users:payment-confirm', args=[response.json()['id']]))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        staff = User.objects.create(email="staff@example.com", is_staff=True)
+        self.client.force_authenticate(user=staff)
+        response = self.client.post(reverse('users:payment-confirm', args=[stripe_payment.pk]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        cash_payment = Payment.objects.get(payment_method='cash')
+        response = self.client.post(reverse('users:payment-confirm', args=[cash_payment.pk]))
+        self.assertEqual(response.json()['status'], Payment.STATUS_PAID)
+
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.get_visible_ids(), ([self.course.pk], [self.lesson.pk]))
+
+    def test_moder_sees_everything(self):
+        """ Модератор видит все курсы и уроки """
+
+        self.user.groups.add(Group.objects.create(name='moders'))
+        self.client.force_authenticate(user=User.objects.get(pk=self.user.pk))
+
+        self.assertEqual(self.get_visible_ids(), ([self.course.pk], [self.lesson.pk, self.single_lesson.pk]))
+
+    def test_is_purchased(self):
+        """ Признак покупки у курса и его уроков считается по правам пользователя без лишних запросов """
+
+        Payment.objects.create(
+            user=self.user, paid_course=self.course, amount=100, payment_method='cash', status=Payment.STATUS_PAID
+        )
+        self.client.get(reverse('lms:course-detail', args=[self.course.pk]))
+
+        self.client.force_authenticate(user=self.owner)
+        data = self.client.get(reverse('lms:course-detail', args=[self.course.pk])).json()
+        self.assertFalse(data['is_purchased'])
+        self.assertFalse(data['lessons'][0]['is_purchased'])
+
+        self.client.force_authenticate(user=self.user)
+        # валидаторы ETag и проверка прав, тело курса из кеша, права пользователя уже закешированы
+        with self.assertNumQueries(2):
+            data = self.client.get(reverse('lms:course-detail', args=[self.course.pk])).json()
+        self.assertTrue(data['is_purchased'])
+        self.assertTrue(data['lessons'][0]['is_purchased'])
+
+        lessons = self.client.get(reverse('lms:lesson-list-create')).json()['results']
+        self.assertEqual([lesson['is_purchased'] for lesson in lessons], [True])
+
+    @override_settings(STRIPE_CHECKOUT_ASYNC=True)
+    def test_own_payment_is_not_purchased(self):
+        """ Платеж, созданный пользователем через API, не отмечает курс и урок купленными """
+
+        Subscription.objects.create(user=self.user, course=self.course)
+        self.client.post(
+            reverse('users:payment-list-create'),
+            {'payment_method': 'cash', 'paid_course': self.course.pk, 'amount': 1},
+        )
+
+        data = self.client.get(reverse('lms:course-detail', args=[self.course.pk])).json()
+        self.assertFalse(data['is_purchased'])
+        self.assertFalse(data['lessons'][0]['is_purchased'])
+        lessons = self.client.get(reverse('lms:lesson-list-create')).json()['results']
+        self.assertEqual([lesson['is_purchased'] for lesson in lessons], [False])
@@ -1,8 +1,11 @@
 from django.urls import path
 from rest_framework.routers import SimpleRouter
 
+from lms import async_views
 from lms.apps import LmsConfig
-from lms.views import CourseViewSet, LessonListCreateAPIView, LessonRetrieveUpdateDestroyAPIView, SubscriptionView
+from lms.views import CourseViewSet, LessonListCreateAPIView, LessonRetrieveUpdateDestroyAPIView, SubscriptionView, \
+    SubscriptionExportAPIView, LessonBulkAPIView, SubscriptionListAPIView, SubscriptionBulkAPIView, \
+    SearchAPIView
 
 app_name = LmsConfig.name
 
@@ -10,7 +13,16 @@ router = SimpleRouter()
 router.register('', CourseViewSet)
 
 urlpatterns = [
+    path('async/courses/', async_views.course_list, name='async-course-list'),
+    path('async/courses/<int:pk>/', async_views.course_detail, name='async-course-detail'),
+    path('async/lessons/', async_views.lesson_list, name='async-lesson-list'),
+    path('async/lessons/<int:pk>/', async_views.lesson_detail, name='async-lesson-detail'),
     path('lessons/', LessonListCreateAPIView.as_view(), name='lesson-list-create'),
+    path('lessons/bulk/', LessonBulkAPIView.as_view(), name='lesson-bulk'),
     path('lessons/<int:pk>/', LessonRetrieveUpdateDestroyAPIView.as_view(), name='lesson-detail'),
+    path('search/', SearchAPIView.as_view(), name='search'),
     path('subscribe/', SubscriptionView.as_view(), name='subscribe'),
+    path('subscriptions/', SubscriptionListAPIView.as_view(), name='subscription-list'),
+    path('subscriptions/bulk/', SubscriptionBulkAPIView.as_view(), name='subscription-bulk'),
+    path('subscriptions/export/', SubscriptionExportAPIView.as_view(), name='subscription-export'),
 ] + router.urls
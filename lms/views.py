@@ -1,23 +1,109 @@
+from collections import Counter
 from datetime import timedelta
+from functools import partial
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 from django.utils.timezone import now
-from rest_framework import viewsets, generics
-from rest_framework.permissions import IsAuthenticated
+from rest_framework import viewsets, generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from lms.exports import export_response
 from lms.models import Course, Lesson, Subscription
-from lms.paginations import CustomPagination
-from lms.serializers import CourseSerializer, LessonSerializer
-from lms.tasks import send_course_update_email
+from lms.paginations import CustomPagination, KeysetPaginationMixin
+from lms.search import SEARCH_TEXT_FIELDS, search, update_search_index
+from lms.serializers import CourseSerializer, LessonBulkSerializer, LessonSerializer, SearchQuerySerializer, \
+    SearchResultSerializer, SubscribeSerializer, SubscriptionBulkSerializer, SubscriptionSerializer
+from lms.services import add_user_flags, bulk_subscribe, bulk_unsubscribe, get_course_bodies, \
+    get_courses_validators, get_visible_courses, get_visible_lessons, strip_user_flags, subscribe, \
+    touch_courses_with_lesson_deltas, unsubscribe
+from lms.tasks import send_course_update_notifications
 from users.permissions import IsModer, IsOwner
+from users.services import get_entitlements
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
     pagination_class = CustomPagination
+    # retrieve фильтрует по pk до get_object, поэтому нечисловой id должен отсекаться маршрутом с ответом 404
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        """ Курсы с признаком подписки и заранее загруженными уроками """
+
+        user = self.request.user
+        return get_visible_courses(user, Course.objects.annotate(
+            annotated_is_subscribed=Exists(
+                Subscription.objects.filter(course=OuterRef('pk'), user_id=user.pk)
+            ),
+        ).prefetch_related('lesson_set').order_by('pk'))
+
+    def get_not_modified_response(self, queryset):
+        """ Отвечает 304 без сериализации, если у клиента актуальная версия курсов """
+
+        etag, last_modified = get_courses_validators(queryset, self.request.user, self.request.get_full_path())
+        if etag is None:
+            return None
+        self.validators = etag, last_modified
+        return get_conditional_response(
+            self.request, etag=quote_etag(etag), last_modified=int(last_modified.timestamp())
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'validators', None) and response.status_code in (200, 304):
+            etag, last_modified = self.validators
+            response.headers['ETag'] = quote_etag(etag)
+            response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def serialize_courses(self, course_ids):
+        """ Сериализует курсы без персональных признаков подписки и покупки для общего кеша """
+
+        serializer = self.get_serializer(self.get_queryset().filter(pk__in=course_ids), many=True)
+        bodies = {}
+        for body in serializer.data:
+            bodies[body['id']] = strip_user_flags(body)
+        return bodies
+
+    def get_courses_data(self, course_ids):
+        bodies = get_course_bodies(course_ids, self.serialize_courses)
+        return add_user_flags(bodies, get_entitlements(self.request.user.pk))
+
+    def list(self, request, *args, **kwargs):
+        not_modified = self.get_not_modified_response(get_visible_courses(request.user))
+        if not_modified is not None:
+            return not_modified
+
+        # Пагинируем только идентификаторы, тела курсов берутся из кеша
+        queryset = self.filter_queryset(get_visible_courses(request.user, Course.objects.order_by('pk').values('id')))
+        page = self.paginate_queryset(queryset)
+        rows = queryset if page is None else page
+        data = self.get_courses_data([row['id'] for row in rows])
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        not_modified = self.get_not_modified_response(get_visible_courses(request.user).filter(pk=kwargs['pk']))
+        if not_modified is not None:
+            return not_modified
+
+        # Для проверки прав достаточно владельца, тело курса берется из кеша
+        instance = get_object_or_404(
+            get_visible_courses(request.user, Course.objects.only('id', 'owner_id')), pk=kwargs['pk']
+        )
+        self.check_object_permissions(request, instance)
+        return Response(self.get_courses_data([instance.pk])[0])
 
     def get_permissions(self):
         if self.action == 'list':
@@ -42,26 +128,26 @@ class CourseViewSet(viewsets.ModelViewSet):
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
+        # Уведомляем подписчиков, только если курс не обновлялся последние 4 часа
+        notify = not instance.updated_at or now() - instance.updated_at >= timedelta(hours=4)
 
-        if instance.updated_at and now() - instance.updated_at < timedelta(hours=4):
-            return Response({"detail": "Курс недавно обновлялся"}, status=400)
-
-        instance.updated_at = now()
-        instance.save()
+        response = super().update(request, *args, **kwargs)
 
-        subscribers = instance.subscribers.all()
-        for subscriber in subscribers:
-            send_course_update_email.delay(instance.id, subscriber.email)
-        return super().update(request, *args, **kwargs)
+        if notify:
+            transaction.on_commit(partial(send_course_update_notifications.delay, instance.id))
+        return response
 
     def partial_update(self, request, *args, **kwargs):
         return self.update(request, *args, **kwargs)
 
-class LessonListCreateAPIView(generics.ListCreateAPIView):
+class LessonListCreateAPIView(KeysetPaginationMixin, generics.ListCreateAPIView):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     pagination_class = CustomPagination
 
+    def get_queryset(self):
+        return get_visible_lessons(self.request.user, Lesson.objects.order_by('pk'))
+
     def get_permissions(self):
         if self.request.method == 'POST':
             self.permission_classes = [IsAuthenticated | IsOwner]
@@ -73,10 +159,88 @@ class LessonListCreateAPIView(generics.ListCreateAPIView):
         serializer.save(owner=self.request.user)
 
 
+class LessonBulkAPIView(APIView):
+    """ Массовое создание (POST) и частичное обновление (PATCH) уроков одной транзакцией.
+
+    По умолчанию любая ошибка отменяет всю пачку, с ?allow_partial=true валидные уроки
+    записываются, а ошибки возвращаются по индексам.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get_items(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError({'detail': 'Ожидается список уроков'})
+        if len(request.data) > settings.LESSON_BULK_MAX_ITEMS:
+            raise ValidationError({'detail': f'Не больше {settings.LESSON_BULK_MAX_ITEMS} уроков за запрос'})
+        return request.data
+
+    def validate_items(self, items, errors=(), partial=False):
+        serializer = LessonBulkSerializer(many=True, partial=partial, context={'request': self.request})
+        valid, item_errors = serializer.validate_items(items)
+        return valid, sorted([*errors, *item_errors], key=lambda error: error['index'])
+
+    def allow_partial(self):
+        return self.request.query_params.get('allow_partial') == 'true'
+
+    def get_response_data(self, lessons, errors):
+        serializer = LessonSerializer(lessons, many=True, context={'request': self.request})
+        return {'lessons': serializer.data, 'errors': errors}
+
+    def post(self, request):
+        valid, errors = self.validate_items(self.get_items(request))
+        if errors and not self.allow_partial():
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            lessons = Lesson.objects.bulk_create([Lesson(owner=request.user, **data) for _, data in valid])
+            touch_courses_with_lesson_deltas(Counter(lesson.course_id for lesson in lessons))
+            update_search_index(Lesson, lessons)
+
+        return Response(self.get_response_data(lessons, errors), status=status.HTTP_201_CREATED)
+
+    def patch(self, request):
+        items = self.get_items(request)
+        ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+        instances = get_visible_lessons(request.user).in_bulk([pk for pk in ids if isinstance(pk, int)])
+        missing = [{'index': index, 'errors': {'id': ['Урок не найден']}}
+                   for index, pk in enumerate(ids) if pk not in instances]
+        # Индексы ошибок считаются по исходному списку, поэтому ненайденные уроки заменяем пустыми
+        valid, errors = self.validate_items(
+            [{} if pk not in instances else item for pk, item in zip(ids, items)], missing, partial=True
+        )
+        if errors and not self.allow_partial():
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        lessons, fields, deltas = [], set(), Counter()
+        for index, data in valid:
+            if ids[index] not in instances:
+                continue
+            lesson = instances[ids[index]]
+            deltas[lesson.course_id] -= 1
+            for field, value in data.items():
+                setattr(lesson, field, value)
+            deltas[lesson.course_id] += 1
+            fields.update(data)
+            lessons.append(lesson)
+
+        with transaction.atomic():
+            if fields:
+                Lesson.objects.bulk_update(lessons, fields)
+            if fields & set(SEARCH_TEXT_FIELDS):
+                update_search_index(Lesson, lessons)
+            touch_courses_with_lesson_deltas(deltas)
+
+        return Response(self.get_response_data(lessons, errors))
+
+
 class LessonRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
 
+    def get_queryset(self):
+        return get_visible_lessons(self.request.user)
+
     def get_permissions(self):
         if self.request.method == 'GET':
             self.permission_classes = [IsAuthenticated | IsModer | IsOwner]
@@ -87,21 +251,95 @@ class LessonRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
         return super().get_permissions()
 
 
+class SearchAPIView(generics.ListAPIView):
+    """ Полнотекстовый поиск по названиям и описаниям курсов и уроков, результаты отсортированы по рангу """
+
+    serializer_class = SearchResultSerializer
+    pagination_class = CustomPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        serializer = SearchQuerySerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        kind = serializer.validated_data.get('type')
+        querysets = {
+            'course': get_visible_courses(self.request.user),
+            'lesson': get_visible_lessons(self.request.user),
+        }
+        return search(serializer.validated_data['q'], {kind: querysets[kind]} if kind else querysets)
+
+
 class SubscriptionView(APIView):
+    """ Подписка на курс: POST переключает подписку, PUT и DELETE идемпотентно подписывают и отписывают """
+
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
-        user = self.request.user
-        course_id = request.data.get('course_id')
+    def get_course_id(self, request):
+        serializer = SubscribeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['course_id']
 
-        course_item = get_object_or_404(Course, id=course_id)
-        subs_item = Subscription.objects.filter(user=user, course=course_item)
+    def post(self, request, *args, **kwargs):
+        course_id = self.get_course_id(request)
 
-        if subs_item.exists():
-            subs_item.delete()
+        # Удаление и вставка сами сообщают, изменилась ли строка, существование курса проверяем только
+        # если вставка ничего не сделала: курса нет или параллельный запрос уже подписал пользователя
+        if unsubscribe(request.user, course_id):
             message = "Подписка удалена"
         else:
-            Subscription.objects.create(user=user, course=course_item)
+            if not subscribe(request.user, course_id):
+                get_object_or_404(Course.objects.only('id'), id=course_id)
             message = "Подписка добавлена"
 
         return Response({"message": message})
+
+    def put(self, request, *args, **kwargs):
+        course_id = self.get_course_id(request)
+        created = subscribe(request.user, course_id)
+        if not created:
+            get_object_or_404(Course.objects.only('id'), id=course_id)
+        return Response(
+            {"message": "Подписка добавлена", "subscribed": True},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    def delete(self, request, *args, **kwargs):
+        unsubscribe(request.user, self.get_course_id(request))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SubscriptionListAPIView(KeysetPaginationMixin, generics.ListAPIView):
+    """ Подписки текущего пользователя вместе с краткими данными курсов """
+
+    serializer_class = SubscriptionSerializer
+    pagination_class = CustomPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Subscription.objects.filter(user=self.request.user).select_related('course').order_by('pk')
+
+
+class SubscriptionBulkAPIView(APIView):
+    """ Массовая подписка (POST) и отписка (DELETE) по списку course_ids """
+
+    permission_classes = [IsAuthenticated]
+
+    def get_course_ids(self, request):
+        serializer = SubscriptionBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['course_ids']
+
+    def post(self, request):
+        return Response(bulk_subscribe(request.user, self.get_course_ids(request)))
+
+    def delete(self, request):
+        return Response(bulk_unsubscribe(request.user, self.get_course_ids(request)))
+
+
+class SubscriptionExportAPIView(APIView):
+    """ Потоковая выгрузка подписок в CSV или NDJSON """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return export_response(request, 'subscriptions')
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from users.models import User, Payment
+from users.models import User, Payment, StripePrice
 
 
 @admin.register(User)
@@ -10,4 +10,11 @@ class UserAdmin(admin.ModelAdmin):
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
-    list_display = ('user', 'payment_date', 'paid_course', 'paid_lesson', 'amount', 'payment_method')
+    list_display = ('user', 'payment_date', 'paid_course', 'paid_lesson', 'amount', 'payment_method', 'status')
+    list_filter = ('status', 'payment_method')
+
+
+@admin.register(StripePrice)
+class StripePriceAdmin(admin.ModelAdmin):
+    list_display = ('product', 'unit_amount', 'currency', 'stripe_price_id', 'is_active')
+    list_filter = ('is_active',)
@@ -0,0 +1,15 @@
+from lms.exports import export_response, register_export_dataset
+from users.models import Payment
+
+PAYMENT_EXPORT_FIELDS = (
+    'id', 'user_id', 'user__email', 'payment_date', 'paid_course_id', 'paid_lesson_id', 'amount',
+    'payment_method', 'status', 'stripe_session_id',
+)
+
+register_export_dataset('payments', Payment.objects.order_by('pk'), PAYMENT_EXPORT_FIELDS, 'payment_date')
+
+
+def export_payments_response(request):
+    """ Потоковая выгрузка платежей по параметрам запроса export_format, date_from и date_to """
+
+    return export_response(request, 'payments')
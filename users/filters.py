@@ -0,0 +1,25 @@
+from django.db.models import Exists, OuterRef
+from django_filters import rest_framework as filters
+
+from users.models import Payment, User
+
+
+class UserFilter(filters.FilterSet):
+    """ Фильтры пользователей по агрегатам платежей, аннотированным в UserViewSet.get_queryset """
+
+    paid_course = filters.NumberFilter(method='filter_paid_course')
+    paid_lesson = filters.NumberFilter(method='filter_paid_lesson')
+    payments_total_min = filters.NumberFilter(field_name='payments_total', lookup_expr='gte')
+    payments_total_max = filters.NumberFilter(field_name='payments_total', lookup_expr='lte')
+    last_payment_after = filters.IsoDateTimeFilter(field_name='last_payment_date', lookup_expr='gte')
+    last_payment_before = filters.IsoDateTimeFilter(field_name='last_payment_date', lookup_expr='lte')
+
+    class Meta:
+        model = User
+        fields = ['city', 'is_active']
+
+    def filter_paid_course(self, queryset, name, value):
+        return queryset.filter(Exists(Payment.objects.filter(user=OuterRef('pk'), paid_course=value)))
+
+    def filter_paid_lesson(self, queryset, name, value):
+        return queryset.filter(Exists(Payment.objects.filter(user=OuterRef('pk'), paid_lesson=value)))
@@ -0,0 +1,28 @@
+from decimal import Decimal
+
+from django.core.management import BaseCommand
+
+from users.models import StripePrice
+from users.services import cache_stripe_prices, get_or_create_stripe_price
+
+
+class Command(BaseCommand):
+    help = 'Прогревает кеш цен stripe, при необходимости создает цены для сумм и отключает устаревшие'
+
+    def add_arguments(self, parser):
+        parser.add_argument('amounts', nargs='*', type=Decimal, help='Суммы, для которых нужны цены')
+        parser.add_argument('--deactivate', nargs='+', default=[], metavar='PRICE_ID', help='Отключить цены stripe')
+
+    def handle(self, *args, **options):
+        # Сохраняем по одной, чтобы сигналы сбросили кеш каждой цены
+        for price in StripePrice.objects.filter(stripe_price_id__in=options['deactivate'], is_active=True):
+            price.is_active = False
+            price.save(update_fields=['is_active'])
+            self.stdout.write(f'Цена {price.stripe_price_id} отключена')
+
+        for amount in options['amounts']:
+            get_or_create_stripe_price(amount)
+
+        prices = list(StripePrice.objects.filter(is_active=True))
+        cache_stripe_prices(prices)
+        self.stdout.write(self.style.SUCCESS(f'В кеш загружено цен: {len(prices)}'))
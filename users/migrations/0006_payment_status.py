@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+def mark_existing_sessions_open(apps, schema_editor):
+    Payment = apps.get_model('users', 'Payment')
+    Payment.objects.filter(stripe_session_id__isnull=False).update(status='open')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_alter_payment_stripe_payment_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Создается сессия оплаты'), ('open', 'Ожидает оплаты'), ('failed', 'Ошибка создания сессии')], default='pending', max_length=20, verbose_name='Статус платежа'),
+        ),
+        migrations.RunPython(mark_existing_sessions_open, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_payment_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripePrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product', models.CharField(max_length=100, verbose_name='Продукт')),
+                ('currency', models.CharField(max_length=3, verbose_name='Валюта')),
+                ('unit_amount', models.PositiveIntegerField(verbose_name='Сумма в копейках')),
+                ('stripe_price_id', models.CharField(max_length=255, unique=True, verbose_name='ID цены Stripe')),
+                ('stripe_product_id', models.CharField(blank=True, max_length=255, null=True, verbose_name='ID продукта Stripe')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активна')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Цена Stripe',
+                'verbose_name_plural': 'Цены Stripe',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('product', 'currency', 'unit_amount'), name='unique_active_stripe_price')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_stripeprice'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Создается сессия оплаты'), ('open', 'Ожидает оплаты'), ('paid', 'Оплачен'), ('failed', 'Ошибка оплаты'), ('expired', 'Сессия оплаты истекла')], default='pending', max_length=20, verbose_name='Статус платежа'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True, verbose_name='ID сессии Stripe'),
+        ),
+    ]
@@ -33,18 +33,63 @@ class Payment(models.Model):
         ('stripe', 'Stripe'),
     ]
 
+    STATUS_PENDING = 'pending'
+    STATUS_OPEN = 'open'
+    STATUS_PAID = 'paid'
+    STATUS_FAILED = 'failed'
+    STATUS_EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Создается сессия оплаты'),
+        (STATUS_OPEN, 'Ожидает оплаты'),
+        (STATUS_PAID, 'Оплачен'),
+        (STATUS_FAILED, 'Ошибка оплаты'),
+        (STATUS_EXPIRED, 'Сессия оплаты истекла'),
+    ]
+    FINAL_STATUSES = (STATUS_PAID, STATUS_FAILED, STATUS_EXPIRED)
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='payments', **NULLABLE)
     payment_date = models.DateTimeField(auto_now_add=True)
     paid_course = models.ForeignKey(Course, on_delete=models.SET_NULL, verbose_name='Оплаченный курс', **NULLABLE)
     paid_lesson = models.ForeignKey(Lesson, on_delete=models.SET_NULL, verbose_name='Оплаченный урок', **NULLABLE)
     amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Сумма оплаты')
     payment_method = models.CharField(max_length=10, choices=PAYMENT_METHOD_CHOICES, verbose_name='Способ оплаты')
-    stripe_session_id = models.CharField(max_length=255, **NULLABLE, verbose_name="ID сессии Stripe")
+    stripe_session_id = models.CharField(max_length=255, **NULLABLE, db_index=True, verbose_name="ID сессии Stripe")
     stripe_payment_url = models.URLField(max_length=500, **NULLABLE, verbose_name="Ссылка на оплату")
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name='Статус платежа'
+    )
 
     class Meta:
         verbose_name = 'Платеж'
         verbose_name_plural = 'Платежи'
+        indexes = [
+            models.Index(fields=['user', 'payment_date'], name='payment_user_date_idx'),
+            models.Index(fields=['paid_course', 'user'], name='payment_course_user_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user} - {self.amount} ({self.payment_date})'
+
+
+class StripePrice(models.Model):
+    product = models.CharField(max_length=100, verbose_name='Продукт')
+    currency = models.CharField(max_length=3, verbose_name='Валюта')
+    unit_amount = models.PositiveIntegerField(verbose_name='Сумма в копейках')
+    stripe_price_id = models.CharField(max_length=255, unique=True, verbose_name='ID цены Stripe')
+    stripe_product_id = models.CharField(max_length=255, **NULLABLE, verbose_name='ID продукта Stripe')
+    is_active = models.BooleanField(default=True, verbose_name='Активна')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Цена Stripe'
+        verbose_name_plural = 'Цены Stripe'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'currency', 'unit_amount'],
+                condition=models.Q(is_active=True),
+                name='unique_active_stripe_price',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.product} - {self.unit_amount / 100} {self.currency} ({self.stripe_price_id})'
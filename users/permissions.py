@@ -1,13 +1,40 @@
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import permissions
 
 from users.models import User
 
+MODERS_GROUP_NAME = 'moders'
+
+
+def get_moder_cache_key(user_id):
+    return f'users:is_moder:{user_id}'
+
+
+def is_moder(user):
+    """ Проверяет членство в группе модераторов, запоминая результат на объекте пользователя и в кеше """
+
+    if not user.is_authenticated:
+        return False
+    if hasattr(user, '_is_moder'):
+        return user._is_moder
+
+    timeout = settings.MODERS_CACHE_TIMEOUT
+    result = cache.get(get_moder_cache_key(user.pk)) if timeout else None
+    if result is None:
+        result = user.groups.filter(name=MODERS_GROUP_NAME).exists()
+        if timeout:
+            cache.set(get_moder_cache_key(user.pk), result, timeout)
+
+    user._is_moder = result
+    return result
+
 
 class IsModer(permissions.BasePermission):
     """ Проверка, является ли пользователь модератором. """
 
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='moders').exists()
+        return is_moder(request.user)
 
 
 class IsOwner(permissions.BasePermission):
@@ -16,6 +43,7 @@ class IsOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if isinstance(obj, User):
             return obj == request.user
-        if hasattr(obj, 'owner'):
-            return obj.owner == request.user
+        # Сравниваем по owner_id, чтобы не загружать владельца отдельным запросом
+        if hasattr(obj, 'owner_id'):
+            return obj.owner_id == request.user.pk
         return False
@@ -1,14 +1,30 @@
 from django.utils.timezone import now
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import ChoiceField, DateField, DateTimeField, DecimalField, IntegerField, \
+    ModelSerializer, Serializer
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 from users.models import User, Payment
+from users.services import PAYMENT_ANALYTICS_PERIODS
 
 
 class PaymentSerializer(ModelSerializer):
     class Meta:
         model = Payment
         fields = '__all__'
+        read_only_fields = ('status',)
+
+
+class PaymentUpdateSerializer(PaymentSerializer):
+    """ Изменение платежа пользователем: способ оплаты, плательщик и оплаченные курс и урок не меняются """
+
+    class Meta(PaymentSerializer.Meta):
+        read_only_fields = ('status', 'user', 'payment_method', 'paid_course', 'paid_lesson')
+
+
+class PaymentAnalyticsQuerySerializer(Serializer):
+    period = ChoiceField(choices=list(PAYMENT_ANALYTICS_PERIODS), default='day')
+    date_from = DateField(required=False)
+    date_to = DateField(required=False)
 
 
 class UserSerializer(ModelSerializer):
@@ -19,6 +35,25 @@ class UserSerializer(ModelSerializer):
         fields = ['id', 'username', 'email', 'payments']
 
 
+class UserListSerializer(ModelSerializer):
+    """ Компактное представление пользователя для списка с агрегатами по платежам """
+
+    payments_total = DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    payments_count = IntegerField(read_only=True)
+    last_payment_date = DateTimeField(read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'email', 'payments_total', 'payments_count', 'last_payment_date']
+
+
+class UserExpandedListSerializer(UserListSerializer):
+    payments = PaymentSerializer(many=True, read_only=True)
+
+    class Meta(UserListSerializer.Meta):
+        fields = UserListSerializer.Meta.fields + ['payments']
+
+
 class UserProfileSerializer(ModelSerializer):
     payments = PaymentSerializer(many=True)
 
@@ -1,25 +1,326 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from decimal import Decimal
+
 import stripe
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DateField, Sum, Value
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+
+from lms.models import Subscription
+from users.models import Payment, StripePrice
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+STRIPE_CURRENCY = 'rub'
+STRIPE_PRODUCT_NAME = 'Payment'
+
+
+def get_paid_payments(user_id):
+    """ Платежи, дающие доступ: только оплаченные.
+
+    Оплату через stripe подтверждает вебхук, наличные и переводы отмечает оплаченными персонал
+    через админку или PaymentConfirmAPIView, поэтому созданный пользователем платеж доступа не дает.
+    """
+
+    return Payment.objects.filter(status=Payment.STATUS_PAID, user_id=user_id)
+
+
+def get_entitlements_cache_key(user_id):
+    return f'users:entitlements:{user_id}'
+
+
+def get_entitlements_query(user_id):
+    """ Пары (вид, id) оплаченных курсов, оплаченных уроков и курсов с подпиской одним UNION-запросом """
+
+    payments = get_paid_payments(user_id).order_by()
+    return payments.filter(paid_course__isnull=False).annotate(kind=Value('courses')).values_list(
+        'kind', 'paid_course_id'
+    ).union(
+        payments.filter(paid_lesson__isnull=False).annotate(kind=Value('lessons')).values_list(
+            'kind', 'paid_lesson_id'
+        ),
+        Subscription.objects.filter(user_id=user_id).order_by().annotate(kind=Value('subscriptions')).values_list(
+            'kind', 'course_id'
+        ),
+    )
+
+
+def build_entitlements(rows):
+    """ Хранит id отсортированными кортежами: в кеше это компактнее множеств, а проверка идет двоичным поиском """
+
+    entitlements = {'courses': set(), 'lessons': set(), 'subscriptions': set()}
+    for kind, pk in rows:
+        entitlements[kind].add(pk)
+    return {kind: tuple(sorted(ids)) for kind, ids in entitlements.items()}
+
+
+def get_entitlements(user_id):
+    """ Возвращает оплаченные курсы, оплаченные уроки и подписки пользователя из кеша или одним запросом """
+
+    cache_key = get_entitlements_cache_key(user_id)
+    entitlements = cache.get(cache_key)
+    if entitlements is None:
+        entitlements = build_entitlements(get_entitlements_query(user_id))
+        cache.set(cache_key, entitlements, settings.ENTITLEMENTS_CACHE_TIMEOUT)
+    return entitlements
+
+
+async def aget_entitlements(user_id):
+    cache_key = get_entitlements_cache_key(user_id)
+    entitlements = await cache.aget(cache_key)
+    if entitlements is None:
+        entitlements = build_entitlements([row async for row in get_entitlements_query(user_id)])
+        await cache.aset(cache_key, entitlements, settings.ENTITLEMENTS_CACHE_TIMEOUT)
+    return entitlements
+
 
-def create_stripe_price(amount):
+def invalidate_entitlements(user_ids):
+    cache.delete_many([get_entitlements_cache_key(user_id) for user_id in user_ids if user_id])
+
+
+def has_entitlement(ids, pk):
+    index = bisect_left(ids, pk)
+    return index < len(ids) and ids[index] == pk
+
+
+def is_course_purchased(entitlements, course_id):
+    return has_entitlement(entitlements['courses'], course_id)
+
+
+def is_lesson_purchased(entitlements, lesson_id, course_id):
+    """ Урок считается купленным, если оплачен он сам или его курс """
+
+    return has_entitlement(entitlements['lessons'], lesson_id) or (
+        course_id is not None and has_entitlement(entitlements['courses'], course_id)
+    )
+
+
+def create_stripe_price(amount, idempotency_key=None, product_id=None):
     """ Создает цену в stripe """
 
+    product = {'product': product_id} if product_id else {'product_data': {"name": STRIPE_PRODUCT_NAME}}
     return stripe.Price.create(
-        currency="rub",
+        currency=STRIPE_CURRENCY,
         unit_amount=int(amount * 100),
-        product_data={"name": "Payment"},
+        idempotency_key=idempotency_key,
+        **product,
     )
 
 
-def create_stripe_sessions(price):
+def create_stripe_sessions(price_id, idempotency_key=None):
     """ Создает сессию на оплату в stripe """
 
     session = stripe.checkout.Session.create(
         success_url="http://127.0.0.1:8000/",
-        line_items=[{"price": price.get('id'), "quantity": 1}],
+        line_items=[{"price": price_id, "quantity": 1}],
         mode="payment",
+        idempotency_key=idempotency_key,
     )
     return session.get('id'), session.get('url')
+
+
+def get_stripe_price_cache_key(product, currency, unit_amount):
+    return f'users:stripe_price:{product}:{currency}:{unit_amount}'
+
+
+def cache_stripe_prices(prices):
+    """ Кладет ID цен stripe в кеш """
+
+    cache.set_many(
+        {
+            get_stripe_price_cache_key(price.product, price.currency, price.unit_amount): price.stripe_price_id
+            for price in prices
+        },
+        settings.STRIPE_PRICE_CACHE_TIMEOUT,
+    )
+
+
+def get_or_create_stripe_price(amount, idempotency_key=None):
+    """ Возвращает ID цены stripe для суммы, создавая цену в stripe только при ее отсутствии в реестре """
+
+    unit_amount = int(amount * 100)
+    cache_key = get_stripe_price_cache_key(STRIPE_PRODUCT_NAME, STRIPE_CURRENCY, unit_amount)
+    price_id = cache.get(cache_key)
+    if price_id:
+        return price_id
+
+    lookup = {'product': STRIPE_PRODUCT_NAME, 'currency': STRIPE_CURRENCY, 'unit_amount': unit_amount}
+    price = StripePrice.objects.filter(is_active=True, **lookup).first()
+    if price is None:
+        # Новые цены вешаем на уже известный продукт, чтобы не плодить продукты в stripe
+        product_id = (
+            StripePrice.objects.filter(product=STRIPE_PRODUCT_NAME, stripe_product_id__isnull=False)
+            .values_list('stripe_product_id', flat=True)
+            .first()
+        )
+        stripe_price = create_stripe_price(amount, idempotency_key=idempotency_key, product_id=product_id)
+        price, _ = StripePrice.objects.get_or_create(
+            is_active=True,
+            **lookup,
+            defaults={'stripe_price_id': stripe_price.get('id'), 'stripe_product_id': stripe_price.get('product')},
+        )
+
+    cache_stripe_prices([price])
+    return price.stripe_price_id
+
+
+def create_checkout_session(payment):
+    """ Создает цену и сессию оплаты для платежа и сохраняет ссылку на оплату """
+
+    # Ключи идемпотентности привязаны к платежу, поэтому повтор задачи не создаст дублей в stripe
+    price_id = get_or_create_stripe_price(payment.amount, idempotency_key=f'payment-{payment.pk}-price')
+    session_id, payment_link = create_stripe_sessions(price_id, idempotency_key=f'payment-{payment.pk}-session')
+    payment.stripe_session_id = session_id
+    payment.stripe_payment_url = payment_link
+    payment.status = payment.STATUS_OPEN
+    payment.save(update_fields=['stripe_session_id', 'stripe_payment_url', 'status'])
+    return payment
+
+
+def get_payment_status_cache_key(session_id):
+    return f'users:payment_status:{session_id}'
+
+
+def update_payment_status(payments, status):
+    """ Меняет статус платежей одним UPDATE и сбрасывает кеш прав и аналитики, сигналы при этом не вызываются """
+
+    # stripe не гарантирует порядок событий, поэтому опоздавшее событие не выводит платеж из итогового статуса
+    payments = payments.exclude(status__in=Payment.FINAL_STATUSES)
+    user_ids = set(payments.values_list('user_id', flat=True))
+    if payments.update(status=status):
+        invalidate_entitlements(user_ids)
+        bump_payment_analytics_version()
+
+
+def set_payment_status(session_id, status):
+    """ Сохраняет статус платежа по ID сессии stripe и сбрасывает кеш """
+
+    update_payment_status(Payment.objects.filter(stripe_session_id=session_id), status)
+    cache.delete(get_payment_status_cache_key(session_id))
+
+
+def get_stripe_session_status(session):
+    """ Переводит состояние сессии stripe в статус платежа """
+
+    if session['payment_status'] in ('paid', 'no_payment_required'):
+        return Payment.STATUS_PAID
+    if session['status'] == 'expired':
+        return Payment.STATUS_EXPIRED
+    return Payment.STATUS_OPEN
+
+
+def get_payment_status(session_id):
+    """ Возвращает статус платежа из кеша или базы, обращаясь в stripe только для неоплаченных сессий """
+
+    cache_key = get_payment_status_cache_key(session_id)
+    status = cache.get(cache_key)
+    if status is not None:
+        return status
+
+    status = Payment.objects.filter(stripe_session_id=session_id).values_list('status', flat=True).first()
+    if status is None:
+        return None
+    if status in Payment.FINAL_STATUSES:
+        cache.set(cache_key, status, settings.PAYMENT_FINAL_STATUS_CACHE_TIMEOUT)
+        return status
+
+    try:
+        session = stripe.checkout.Session.retrieve(session_id)
+    except stripe.StripeError:
+        return status
+    live_status = get_stripe_session_status(session)
+    if live_status != status:
+        update_payment_status(Payment.objects.filter(stripe_session_id=session_id), live_status)
+    timeout = (
+        settings.PAYMENT_FINAL_STATUS_CACHE_TIMEOUT
+        if live_status in Payment.FINAL_STATUSES else settings.PAYMENT_STATUS_CACHE_TTL
+    )
+    cache.set(cache_key, live_status, timeout)
+    return live_status
+
+
+def handle_stripe_event(payload, signature):
+    """ Проверяет подпись вебхука stripe и обновляет статусы платежей и реестр цен """
+
+    event = stripe.Webhook.construct_event(payload, signature, settings.STRIPE_WEBHOOK_SECRET)
+    event_type = event['type']
+    obj = event['data']['object']
+
+    if event_type in ('checkout.session.completed', 'checkout.session.expired'):
+        set_payment_status(obj['id'], get_stripe_session_status(obj))
+    elif event_type == 'checkout.session.async_payment_succeeded':
+        set_payment_status(obj['id'], Payment.STATUS_PAID)
+    elif event_type == 'checkout.session.async_payment_failed':
+        set_payment_status(obj['id'], Payment.STATUS_FAILED)
+    elif event_type == 'price.deleted' or (event_type == 'price.updated' and not obj['active']):
+        # Сохраняем по одной, чтобы сигналы сбросили кеш цены
+        for price in StripePrice.objects.filter(stripe_price_id=obj['id'], is_active=True):
+            price.is_active = False
+            price.save(update_fields=['is_active'])
+    return event
+
+
+PAYMENT_ANALYTICS_PERIODS = {
+    'day': TruncDate('payment_date'),
+    'week': TruncWeek('payment_date', output_field=DateField()),
+    'month': TruncMonth('payment_date', output_field=DateField()),
+}
+PAYMENT_ANALYTICS_VERSION_KEY = 'users:payment_analytics_version'
+
+
+def bump_payment_analytics_version():
+    cache.set(PAYMENT_ANALYTICS_VERSION_KEY, time.time_ns(), None)
+
+
+def format_amount(amount):
+    return str(amount.quantize(Decimal('0.01')))
+
+
+def summarize_payments(rows, key):
+    """ Сворачивает сгруппированные строки платежей по одному ключу """
+
+    totals = defaultdict(lambda: {'total': Decimal('0'), 'count': 0})
+    for row in rows:
+        totals[row[key]]['total'] += row['total']
+        totals[row[key]]['count'] += row['count']
+    return [
+        {key: value, 'total': format_amount(summary['total']), 'count': summary['count']}
+        for value, summary in totals.items()
+    ]
+
+
+def get_payment_analytics(period='day', date_from=None, date_to=None):
+    """ Считает выручку оплаченных платежей по периодам, способам оплаты, курсам и урокам одним запросом с GROUP BY """
+
+    version = cache.get_or_set(PAYMENT_ANALYTICS_VERSION_KEY, time.time_ns, None)
+    cache_key = f'users:payment_analytics:{version}:{period}:{date_from}:{date_to}'
+    analytics = cache.get(cache_key)
+    if analytics is not None:
+        return analytics
+
+    queryset = Payment.objects.filter(status=Payment.STATUS_PAID)
+    if date_from:
+        queryset = queryset.filter(payment_date__date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(payment_date__date__lte=date_to)
+    rows = list(
+        queryset.annotate(period=PAYMENT_ANALYTICS_PERIODS[period])
+        .values('period', 'payment_method', 'paid_course', 'paid_lesson')
+        .annotate(total=Sum('amount'), count=Count('pk'))
+        .order_by('period')
+    )
+
+    analytics = {
+        'period': period,
+        'total': format_amount(sum((row['total'] for row in rows), Decimal('0'))),
+        'count': sum(row['count'] for row in rows),
+        'by_period': summarize_payments(rows, 'period'),
+        'by_payment_method': summarize_payments(rows, 'payment_method'),
+        'by_course': summarize_payments([row for row in rows if row['paid_course']], 'paid_course'),
+        'by_lesson': summarize_payments([row for row in rows if row['paid_lesson']], 'paid_lesson'),
+    }
+    cache.set(cache_key, analytics, settings.PAYMENT_ANALYTICS_CACHE_TTL)
+    return analytics
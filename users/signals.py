@@ -0,0 +1,49 @@
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from users.models import Payment, StripePrice, User
+from users.permissions import get_moder_cache_key
+from users.services import bump_payment_analytics_version, get_payment_status_cache_key, get_stripe_price_cache_key, \
+    invalidate_entitlements
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_moder_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Сбрасывает закешированное членство в группе модераторов при изменении групп пользователя """
+
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        user_ids = [instance.pk]
+    elif reverse and action in ('post_add', 'post_remove'):
+        user_ids = pk_set or []
+    elif reverse and action == 'pre_clear':
+        # После очистки состав группы уже не узнать, поэтому собираем пользователей заранее
+        user_ids = list(instance.user_set.values_list('pk', flat=True))
+    else:
+        return
+    cache.delete_many([get_moder_cache_key(user_id) for user_id in user_ids])
+    if not reverse and hasattr(instance, '_is_moder'):
+        del instance._is_moder
+
+
+@receiver([post_save, post_delete], sender=StripePrice)
+def invalidate_stripe_price_cache(sender, instance, **kwargs):
+    """ Сбрасывает закешированный ID цены stripe при изменении реестра цен """
+
+    cache.delete(get_stripe_price_cache_key(instance.product, instance.currency, instance.unit_amount))
+
+
+@receiver([post_save, post_delete], sender=Payment)
+def invalidate_payment_status_cache(sender, instance, **kwargs):
+    """ Сбрасывает закешированный статус платежа и аналитику платежей при их изменении """
+
+    if instance.stripe_session_id:
+        cache.delete(get_payment_status_cache_key(instance.stripe_session_id))
+    bump_payment_analytics_version()
+
+
+@receiver([post_save, post_delete], sender=Payment)
+def invalidate_payment_entitlements(sender, instance, **kwargs):
+    """ Сбрасывает закешированные оплаченные курсы и уроки пользователя """
+
+    invalidate_entitlements([instance.user_id])
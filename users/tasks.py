@@ -1,13 +1,38 @@
 from datetime import timedelta
 
+import stripe
 from celery import shared_task
 from django.utils.timezone import now
 
-from users.models import User
+from users.models import User, Payment
+from users.services import create_checkout_session, update_payment_status
+
+RETRYABLE_STRIPE_ERRORS = (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError)
 
 
 @shared_task
 def deactivate_inactive_users():
     one_month_ago = now() - timedelta(days=30)
     inactive_users = User.objects.filter(last_login__lt=one_month_ago, is_active=True)
-    inactive_users.update(is_active=False)
\ No newline at end of file
+    inactive_users.update(is_active=False)
+
+
+@shared_task(bind=True, max_retries=5)
+def create_payment_checkout(self, payment_id):
+    """ Создает сессию оплаты stripe для сохраненного платежа """
+
+    payment = Payment.objects.filter(pk=payment_id, status=Payment.STATUS_PENDING).first()
+    if payment is None:
+        return None
+
+    try:
+        create_checkout_session(payment)
+    except RETRYABLE_STRIPE_ERRORS as error:
+        if self.request.retries >= self.max_retries:
+            update_payment_status(Payment.objects.filter(pk=payment_id), Payment.STATUS_FAILED)
+            raise
+        raise self.retry(exc=error, countdown=2 ** self.request.retries)
+    except stripe.StripeError:
+        update_payment_status(Payment.objects.filter(pk=payment_id), Payment.STATUS_FAILED)
+        raise
+    return payment.stripe_session_id
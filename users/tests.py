@@ -1,11 +1,54 @@
+import hashlib
+import hmac
+import json
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from users.models import User, Payment
+from lms.models import Course, Lesson, Subscription
+from users.models import User, Payment, StripePrice
 from rest_framework_simplejwt.tokens import RefreshToken
+from users.permissions import is_moder
+from users.services import create_checkout_session, get_entitlements, get_entitlements_cache_key, set_payment_status
+from users.tasks import create_payment_checkout
 from decimal import Decimal
 
 
+class StripeStub:
+    """ Локальная заглушка клиента stripe, запоминающая вызовы """
+
+    def __init__(self):
+        self.calls = []
+        self.Price = SimpleNamespace(create=self.create_price)
+        self.checkout = SimpleNamespace(
+            Session=SimpleNamespace(create=self.create_session, retrieve=self.retrieve_session)
+        )
+        self.session_payment_status = 'unpaid'
+
+    def create_price(self, **params):
+        self.calls.append(('price', params))
+        return {
+            'id': f'price_{len(self.calls)}',
+            'product': params.get('product', 'prod_test'),
+            'unit_amount': params['unit_amount'],
+        }
+
+    def create_session(self, **params):
+        self.calls.append(('session', params))
+        session_id = f'cs_test_{len(self.calls)}'
+        return {'id': session_id, 'url': f'https://checkout.stripe.com/c/pay/{session_id}'}
+
+    def retrieve_session(self, session_id):
+        self.calls.append(('retrieve', session_id))
+        return {'id': session_id, 'status': 'open', 'payment_status': self.session_payment_status}
+
+
 class UserViewSetTestCase(APITestCase):
     def setUp(self):
         """ Создание пользователя и установка JWT-токена для авторизации """
@@ -30,7 +73,7 @@ class UserViewSetTestCase(APITestCase):
         data = {'search': 'user@example.com'}
         response = self.client.get(url, data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_user_ordering(self):
         """ Тестирование сортировки пользователей """
@@ -40,6 +83,81 @@ class UserViewSetTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+class UserListPaymentsTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователей с платежами """
+
+        self.user = User.objects.create(email='user@example.com', password='password')
+        self.client.force_authenticate(user=self.user)
+        for number in range(3):
+            user = User.objects.create(email=f'payer{number}@example.com')
+            for amount in (100, 200):
+                Payment.objects.create(amount=amount, user=user, payment_method='cash')
+
+    def test_list_aggregates(self):
+        """ Список пользователей содержит суммы платежей и не зависит от их количества по запросам """
+
+        url = reverse('users:user-list')
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        results = response.json()['results']
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(results[0]['payments_count'], 0)
+        self.assertEqual(Decimal(results[1]['payments_total']), Decimal('300'))
+        self.assertEqual(results[1]['payments_count'], 2)
+        self.assertNotIn('payments', results[1])
+
+    def test_list_expand_payments(self):
+        """ Платежи в списке подгружаются одним запросом по ?expand=payments """
+
+        url = reverse('users:user-list')
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'expand': 'payments'})
+        results = response.json()['results']
+
+        self.assertEqual(len(results[1]['payments']), 2)
+
+    def test_ordering_by_payments_total(self):
+        """ Сортировка пользователей по сумме платежей """
+
+        payer = User.objects.get(email='payer2@example.com')
+        Payment.objects.create(amount=1000, user=payer, payment_method='cash')
+        url = reverse('users:user-list')
+        response = self.client.get(url, {'ordering': '-payments_total', 'page_size': 10})
+        results = response.json()['results']
+
+        self.assertEqual(results[0]['email'], 'payer2@example.com')
+        self.assertEqual(Decimal(results[0]['payments_total']), Decimal('1300'))
+        self.assertEqual(results[-1]['email'], 'user@example.com')
+
+    def test_filter_by_paid_course(self):
+        """ Фильтр пользователей по оплаченному курсу и поиск по почте """
+
+        course = Course.objects.create(title='Test Course')
+        payer = User.objects.get(email='payer1@example.com')
+        Payment.objects.create(amount=500, user=payer, paid_course=course, payment_method='cash')
+        url = reverse('users:user-list')
+
+        response = self.client.get(url, {'paid_course': course.pk})
+        self.assertEqual([user['email'] for user in response.json()['results']], ['payer1@example.com'])
+
+        response = self.client.get(url, {'search': 'payer0'})
+        self.assertEqual([user['email'] for user in response.json()['results']], ['payer0@example.com'])
+
+    def test_user_payments(self):
+        """ История платежей пользователя отдается постранично """
+
+        payer = User.objects.get(email='payer0@example.com')
+        url = reverse('users:user-payments', args=(payer.pk,))
+        response = self.client.get(url, {'page_size': 1})
+        data = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(len(data['results']), 1)
+
+
 class UserCreateAPIViewTests(APITestCase):
     def test_create_user(self):
         """ Тестирование создания пользователя """
@@ -92,16 +210,49 @@ class PaymentTestCase(APITestCase):
         self.token = str(refresh.access_token)
         self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
         self.payment = Payment.objects.create(amount=50.0, user=self.user, payment_method='cash')
+        cache.clear()
 
+    @override_settings(STRIPE_CHECKOUT_ASYNC=False)
     def test_create_payment(self):
         """ Тестирование создания платежа """
 
         url = reverse('users:payment-list-create')
         data = {'amount': 100.0, 'user': self.user.pk, 'payment_method': 'transfer'}
-        response = self.client.post(url, data)
+        with mock.patch('users.services.stripe', StripeStub()):
+            response = self.client.post(url, data)
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Payment.objects.count(), 2)
+        self.assertEqual(response.json().get('status'), Payment.STATUS_OPEN)
+
+    @override_settings(STRIPE_CHECKOUT_ASYNC=True)
+    def test_create_payment_async(self):
+        """ Тестирование создания платежа с фоновым созданием сессии stripe """
+
+        url = reverse('users:payment-list-create')
+        data = {'amount': 100.0, 'user': self.user.pk, 'payment_method': 'transfer'}
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(url, data)
+        data = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(data.get('status'), Payment.STATUS_PENDING)
+        self.assertIsNone(data.get('stripe_payment_url'))
+        self.assertEqual(len(callbacks), 1)
+
+        stripe_stub = StripeStub()
+        with mock.patch('users.services.stripe', stripe_stub):
+            create_payment_checkout(data['id'])
+            # Повторный запуск задачи не создает новую сессию
+            create_payment_checkout(data['id'])
+
+        self.assertEqual(len(stripe_stub.calls), 2)
+        self.assertEqual(stripe_stub.calls[0][1]['idempotency_key'], f'payment-{data["id"]}-price')
+
+        response = self.client.get(reverse('users:payment-detail', args=(data['id'],)))
+        data = response.json()
+        self.assertEqual(data.get('status'), Payment.STATUS_OPEN)
+        self.assertTrue(data.get('stripe_payment_url').startswith('https://checkout.stripe.com/'))
 
     def test_list_payments(self):
         """ Тестирование отображения платежей """
@@ -112,6 +263,30 @@ class PaymentTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertGreater(len(response.data), 0)
 
+    def test_list_payments_keyset_pagination(self):
+        """ Тестирование пагинации платежей по ключу """
+
+        url = reverse('users:payment-list-create')
+        response = self.client.get(url, {'pagination': 'cursor'})
+        data = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([payment['id'] for payment in data['results']], [self.payment.pk])
+
+    def test_export_payments_csv(self):
+        """ Тестирование потоковой выгрузки платежей в CSV """
+
+        self.user.is_staff = True
+        self.user.save()
+        url = reverse('users:payment-export')
+        response = self.client.get(url)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(f'{self.payment.pk},{self.user.pk},user@example.com,'))
+
     def test_retrieve_payment(self):
         """ Тестирование отображения данных платежа """
 
@@ -139,3 +314,305 @@ class PaymentTestCase(APITestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Payment.objects.all().count(), 0)
+
+
+class IsModerCacheTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователя и группы модераторов """
+
+        cache.clear()
+        self.user = User.objects.create(email='user@example.com', password='password')
+        self.group = Group.objects.create(name='moders')
+
+    def test_membership_memoized_on_user(self):
+        """ Повторная проверка в рамках запроса не обращается к базе """
+
+        with self.assertNumQueries(1):
+            self.assertFalse(is_moder(self.user))
+            self.assertFalse(is_moder(self.user))
+
+    def test_membership_cached_between_requests(self):
+        """ Новый объект пользователя берет признак из кеша """
+
+        is_moder(self.user)
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(is_moder(user))
+
+    def test_cache_invalidated_on_groups_change(self):
+        """ Изменение групп пользователя сбрасывает кеш """
+
+        self.assertFalse(is_moder(self.user))
+        self.user.groups.add(self.group)
+        self.assertTrue(is_moder(User.objects.get(pk=self.user.pk)))
+        self.group.user_set.remove(self.user)
+        self.assertFalse(is_moder(User.objects.get(pk=self.user.pk)))
+
+
+class EntitlementsTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователя, курсов, урока, подписки и платежей """
+
+        cache.clear()
+        self.user = User.objects.create(email='user@example.com', password='password')
+        self.courses = [Course.objects.create(title=f'Course {number}') for number in range(3)]
+        self.lesson = Lesson.objects.create(title='Lesson', course=self.courses[0])
+        Subscription.objects.create(user=self.user, course=self.courses[1])
+        Payment.objects.create(
+            amount=10, user=self.user, paid_course=self.courses[2], payment_method='cash', status=Payment.STATUS_PAID
+        )
+        Payment.objects.create(
+            amount=10, user=self.user, paid_lesson=self.lesson, payment_method='transfer', status=Payment.STATUS_PAID
+        )
+        # Неподтвержденный платеж наличными прав не дает
+        Payment.objects.create(amount=10, user=self.user, paid_course=self.courses[1], payment_method='cash')
+        Payment.objects.create(
+            amount=10, user=self.user, paid_course=self.courses[0], payment_method='stripe',
+            stripe_session_id='cs_test_1', status=Payment.STATUS_OPEN,
+        )
+
+    def test_computed_in_one_query_and_cached(self):
+        """ Права собираются одним запросом в отсортированные кортежи и дальше берутся из кеша """
+
+        with self.assertNumQueries(1):
+            entitlements = get_entitlements(self.user.pk)
+        with self.assertNumQueries(0):
+            get_entitlements(self.user.pk)
+
+        self.assertEqual(entitlements, {
+            'courses': (self.courses[2].pk,),
+            'lessons': (self.lesson.pk,),
+            'subscriptions': (self.courses[1].pk,),
+        })
+
+    def test_invalidated_on_payment_and_subscription_changes(self):
+        """ Подтверждение оплаты, удаление платежа и отписка сбрасывают кеш прав """
+
+        get_entitlements(self.user.pk)
+        set_payment_status('cs_test_1', Payment.STATUS_PAID)
+        self.assertEqual(get_entitlements(self.user.pk)['courses'], (self.courses[0].pk, self.courses[2].pk))
+
+        Payment.objects.filter(paid_lesson=self.lesson).delete()
+        self.assertEqual(get_entitlements(self.user.pk)['lessons'], ())
+
+        Subscription.objects.filter(user=self.user).delete()
+        self.assertEqual(get_entitlements(self.user.pk)['subscriptions'], ())
+
+    def test_invalidated_on_any_status_change(self):
+        """ Любое изменение статуса в обход сигналов сбрасывает кеш прав, а итоговый статус не меняется """
+
+        get_entitlements(self.user.pk)
+        set_payment_status('cs_test_1', Payment.STATUS_FAILED)
+        self.assertIsNone(cache.get(get_entitlements_cache_key(self.user.pk)))
+
+        get_entitlements(self.user.pk)
+        set_payment_status('cs_test_1', Payment.STATUS_PAID)
+        self.assertIsNotNone(cache.get(get_entitlements_cache_key(self.user.pk)))
+        self.assertEqual(Payment.objects.get(stripe_session_id='cs_test_1').status, Payment.STATUS_FAILED)
+
+
+class StripePriceRegistryTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователя и заглушки stripe """
+
+        cache.clear()
+        self.user = User.objects.create(email='user@example.com', password='password')
+        self.stripe_stub = StripeStub()
+        patcher = mock.patch('users.services.stripe', self.stripe_stub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_payment(self, amount):
+        payment = Payment.objects.create(amount=amount, user=self.user, payment_method='stripe')
+        return create_checkout_session(payment)
+
+    def test_price_reused_for_same_amount(self):
+        """ Цена stripe создается один раз на сумму """
+
+        self.create_payment(Decimal('1000.00'))
+        self.create_payment(Decimal('1000.00'))
+        self.create_payment(Decimal('1500.00'))
+
+        price_calls = [params for kind, params in self.stripe_stub.calls if kind == 'price']
+        self.assertEqual(len(price_calls), 2)
+        # Вторая цена привязывается к уже созданному продукту
+        self.assertEqual(price_calls[1].get('product'), 'prod_test')
+        self.assertEqual(StripePrice.objects.count(), 2)
+
+    def test_deactivated_price_recreated(self):
+        """ Отключенная цена не используется для новых платежей """
+
+        self.create_payment(Decimal('1000.00'))
+        price = StripePrice.objects.get()
+        price.is_active = False
+        price.save()
+        self.create_payment(Decimal('1000.00'))
+
+        price_calls = [params for kind, params in self.stripe_stub.calls if kind == 'price']
+        self.assertEqual(len(price_calls), 2)
+        self.assertEqual(StripePrice.objects.filter(is_active=True).count(), 1)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class PaymentStatusTestCase(APITestCase):
+    def setUp(self):
+        """ Создание пользователя и платежа с открытой сессией stripe """
+
+        cache.clear()
+        self.user = User.objects.create(email='user@example.com', password='password')
+        self.client.force_authenticate(user=self.user)
+        self.payment = Payment.objects.create(
+            amount=50.0, user=self.user, payment_method='stripe', stripe_session_id='cs_test_1', status='open'
+        )
+        self.url = reverse('users:payment-status', args=('cs_test_1',))
+
+    def post_webhook(self, event, secret='whsec_test'):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            reverse('users:payment-webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    def test_pending_status_cached(self):
+        """ Неоплаченная сессия проверяется в stripe один раз за время жизни кеша """
+
+        stripe_stub = StripeStub()
+        with mock.patch('users.services.stripe', stripe_stub):
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+
+        self.assertEqual(first.json().get('payment_status'), Payment.STATUS_OPEN)
+        self.assertEqual(second.json().get('payment_status'), Payment.STATUS_OPEN)
+        self.assertEqual(len(stripe_stub.calls), 1)
+
+    def test_webhook_updates_status(self):
+        """ Вебхук об оплате обновляет статус, после чего stripe не опрашивается """
+
+        event = {
+            'id': 'evt_test', 'object': 'event', 'type': 'checkout.session.completed',
+            'data': {'object': {
+                'id': 'cs_test_1', 'object': 'checkout.session', 'status': 'complete', 'payment_status': 'paid',
+            }},
+        }
+        response = self.post_webhook(event)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.STATUS_PAID)
+
+        stripe_stub = StripeStub()
+        with mock.patch('users.services.stripe', stripe_stub):
+            response = self.client.get(self.url)
+        self.assertEqual(response.json().get('payment_status'), Payment.STATUS_PAID)
+        self.assertEqual(stripe_stub.calls, [])
+
+    def test_webhook_invalid_signature(self):
+        """ Вебхук с неверной подписью отклоняется """
+
+        event = {'id': 'evt_test', 'type': 'checkout.session.completed', 'data': {'object': {'id': 'cs_test_1'}}}
+        response = self.post_webhook(event, secret='whsec_wrong')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.STATUS_OPEN)
+
+    def test_webhook_keeps_final_status(self):
+        """ Опоздавшие события о неоплаченной или истекшей сессии не отменяют подтвержденную оплату """
+
+        session = {'id': 'cs_test_1', 'object': 'checkout.session', 'status': 'complete', 'payment_status': 'paid'}
+        self.post_webhook({
+            'id': 'evt_paid', 'object': 'event', 'type': 'checkout.session.async_payment_succeeded',
+            'data': {'object': session},
+        })
+        for event_type, session_status in (('checkout.session.completed', 'complete'),
+                                           ('checkout.session.expired', 'expired')):
+            response = self.post_webhook({
+                'id': 'evt_late', 'object': 'event', 'type': event_type,
+                'data': {'object': {**session, 'status': session_status, 'payment_status': 'unpaid'}},
+            })
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.STATUS_PAID)
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=None)
+    def test_webhook_secret_not_configured(self):
+        """ Без STRIPE_WEBHOOK_SECRET вебхук отклоняется с 503, а не падает """
+
+        event = {'id': 'evt_test', 'type': 'checkout.session.completed', 'data': {'object': {'id': 'cs_test_1'}}}
+        response = self.post_webhook(event)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_unknown_session(self):
+        """ Статус неизвестной сессии возвращает 404 """
+
+        response = self.client.get(reverse('users:payment-status', args=('cs_unknown',)))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PaymentAnalyticsTestCase(APITestCase):
+    def setUp(self):
+        """ Создание администратора, курса и платежей """
+
+        cache.clear()
+        self.user = User.objects.create(email='admin@example.com', is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(title='Test Course')
+        paid = {'user': self.user, 'status': Payment.STATUS_PAID}
+        Payment.objects.create(amount=100, payment_method='cash', paid_course=self.course, **paid)
+        Payment.objects.create(amount=200, payment_method='cash', **paid)
+        Payment.objects.create(amount=300, payment_method='transfer', paid_course=self.course, **paid)
+        # Неоплаченные и неуспешные платежи в выручку не попадают
+        Payment.objects.create(amount=1000, user=self.user, payment_method='cash')
+        Payment.objects.create(
+            amount=1000, user=self.user, payment_method='stripe', paid_course=self.course,
+            stripe_session_id='cs_failed', status=Payment.STATUS_FAILED,
+        )
+        self.url = reverse('users:payment-analytics')
+
+    def test_analytics(self):
+        """ Выручка считается одним запросом и разбивается по способам оплаты и курсам """
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'period': 'month'})
+        data = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Decimal(data['total']), Decimal('600'))
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(data['by_period']), 1)
+        by_method = {row['payment_method']: Decimal(row['total']) for row in data['by_payment_method']}
+        self.assertEqual(by_method, {'cash': Decimal('300'), 'transfer': Decimal('300')})
+        self.assertEqual(data['by_course'], [{'paid_course': self.course.pk, 'total': '400.00', 'count': 2}])
+
+    def test_analytics_cached_until_new_payment(self):
+        """ Аналитика кешируется и сбрасывается при новом платеже """
+
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        Payment.objects.create(amount=400, user=self.user, payment_method='cash', status=Payment.STATUS_PAID)
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['count'], 4)
+
+    def test_analytics_reset_on_status_update(self):
+        """ Массовое обновление статуса без сигналов тоже сбрасывает кеш аналитики """
+
+        Payment.objects.create(
+            amount=500, user=self.user, payment_method='stripe',
+            stripe_session_id='cs_open', status=Payment.STATUS_OPEN,
+        )
+        self.assertEqual(self.client.get(self.url).json()['count'], 3)
+
+        set_payment_status('cs_open', Payment.STATUS_PAID)
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['count'], 4)
+        self.assertEqual(Decimal(data['total']), Decimal('1100'))
+
+    def test_analytics_forbidden_for_regular_user(self):
+        """ Аналитика недоступна обычному пользователю """
+
+        self.client.force_authenticate(user=User.objects.create(email='user@example.com'))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -4,7 +4,8 @@ from rest_framework.routers import SimpleRouter
 from users.apps import UsersConfig
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from users.views import UserViewSet, PaymentListCreateAPIView, \
-    PaymentRetrieveUpdateDestroyAPIView, UserCreateAPIView, UserProfileView, PaymentStatusAPIView
+    PaymentRetrieveUpdateDestroyAPIView, UserCreateAPIView, UserProfileView, PaymentStatusAPIView, \
+    StripeWebhookAPIView, PaymentAnalyticsAPIView, PaymentExportAPIView, PaymentConfirmAPIView
 
 app_name = UsersConfig.name
 
@@ -18,6 +19,10 @@ urlpatterns = [
     path('profile/<int:pk>/', UserProfileView.as_view(), name='user-profile'),
 
     path('payment/', PaymentListCreateAPIView.as_view(), name='payment-list-create'),
+    path('payment/analytics/', PaymentAnalyticsAPIView.as_view(), name='payment-analytics'),
+    path('payment/export/', PaymentExportAPIView.as_view(), name='payment-export'),
     path('payment/<int:pk>/', PaymentRetrieveUpdateDestroyAPIView.as_view(), name='payment-detail'),
+    path('payment/<int:pk>/confirm/', PaymentConfirmAPIView.as_view(), name='payment-confirm'),
     path('payment/status/<str:session_id>/', PaymentStatusAPIView.as_view(), name='payment-status'),
+    path('payment/webhook/', StripeWebhookAPIView.as_view(), name='payment-webhook'),
 ] + router.urls
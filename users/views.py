@@ -1,24 +1,80 @@
-import stripe
+from decimal import Decimal
+from functools import partial
 
-from django.http import JsonResponse
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import Http404, JsonResponse
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets, generics, filters
-from rest_framework.generics import CreateAPIView
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework import viewsets, generics, filters, status
+from rest_framework.decorators import action
+from rest_framework.generics import CreateAPIView, get_object_or_404
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
 
+from lms.paginations import CustomPagination, KeysetPaginationMixin
 from users.models import User, Payment
-from users.permissions import IsOwner
-from users.serializers import UserSerializer, PaymentSerializer, UserProfileSerializer, CustomTokenObtainPairSerializer
-from users.services import create_stripe_price, create_stripe_sessions
+from users.permissions import IsModer, IsOwner
+from users.exports import export_payments_response
+from users.filters import UserFilter
+from users.serializers import UserSerializer, PaymentSerializer, UserProfileSerializer, \
+    CustomTokenObtainPairSerializer, UserListSerializer, UserExpandedListSerializer, PaymentAnalyticsQuerySerializer, \
+    PaymentUpdateSerializer
+from users.services import create_checkout_session, get_payment_analytics, get_payment_status, handle_stripe_event
+from users.tasks import create_payment_checkout
 
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = CustomPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter, filters.SearchFilter]
-    ordering_fields = ('paid_course', 'paid_lesson')
+    filterset_class = UserFilter
+    ordering_fields = ('email', 'payments_total', 'payments_count', 'last_payment_date')
+    search_fields = ('email', 'first_name', 'last_name', 'city')
+
+    def expand_payments(self):
+        return 'payments' in self.request.query_params.get('expand', '').split(',')
+
+    def get_queryset(self):
+        queryset = User.objects.order_by('pk')
+        if self.action == 'list':
+            # Подзапросы вместо JOIN с GROUP BY, чтобы сортировка и фильтры шли по индексу Payment(user, payment_date)
+            payments = Payment.objects.filter(user=OuterRef('pk')).order_by().values('user')
+            queryset = queryset.annotate(
+                payments_total=Coalesce(
+                    Subquery(payments.annotate(total=Sum('amount')).values('total')),
+                    Value(Decimal('0')),
+                    output_field=DecimalField(),
+                ),
+                payments_count=Coalesce(Subquery(payments.annotate(total=Count('pk')).values('total')), 0),
+                last_payment_date=Subquery(
+                    Payment.objects.filter(user=OuterRef('pk')).order_by('-payment_date').values('payment_date')[:1]
+                ),
+            )
+            if self.expand_payments():
+                queryset = queryset.prefetch_related(Prefetch('payments', queryset=Payment.objects.order_by('pk')))
+        elif self.action == 'retrieve':
+            queryset = queryset.prefetch_related('payments')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return UserExpandedListSerializer if self.expand_payments() else UserListSerializer
+        return super().get_serializer_class()
+
+    @action(detail=True, methods=['get'])
+    def payments(self, request, pk=None):
+        """ История платежей пользователя постранично """
+
+        user = self.get_object()
+        page = self.paginate_queryset(Payment.objects.filter(user=user).order_by('pk'))
+        serializer = PaymentSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
 
 
 class UserCreateAPIView(CreateAPIView):
@@ -51,36 +107,106 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
         serializer.save()
 
 
-class PaymentListCreateAPIView(generics.ListCreateAPIView):
+class PaymentListCreateAPIView(KeysetPaginationMixin, generics.ListCreateAPIView):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
 
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if settings.STRIPE_CHECKOUT_ASYNC:
+            # Сессия оплаты создается в фоне, готовность видна по статусу платежа
+            response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
     def perform_create(self, serializer):
         payment = serializer.save(user=self.request.user)
-        price = create_stripe_price(payment.amount)
-        session_id, payment_link = create_stripe_sessions(price)
-        payment.stripe_session_id = session_id
-        payment.stripe_payment_url = payment_link
-        payment.save()
+        if settings.STRIPE_CHECKOUT_ASYNC:
+            transaction.on_commit(partial(create_payment_checkout.delay, payment.pk))
+        else:
+            create_checkout_session(payment)
+
+
+class PaymentAnalyticsAPIView(APIView):
+    """Выручка по периодам, способам оплаты, курсам и урокам для дашбордов"""
+
+    permission_classes = [IsAdminUser | IsModer]
+
+    def get(self, request):
+        serializer = PaymentAnalyticsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(get_payment_analytics(**serializer.validated_data))
+
+
+class PaymentExportAPIView(APIView):
+    """Потоковая выгрузка платежей в CSV или NDJSON"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return export_payments_response(request)
 
 
 class PaymentRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
 
+    def get_serializer_class(self):
+        # Поля, от которых зависит доступ к курсам, меняет только персонал
+        if self.request.method in ('PUT', 'PATCH') and not self.request.user.is_staff:
+            return PaymentUpdateSerializer
+        return super().get_serializer_class()
+
+
+class PaymentConfirmAPIView(APIView):
+    """Подтверждение оплаты наличными или переводом персоналом, оплату через stripe подтверждает вебхук"""
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, pk):
+        payment = get_object_or_404(Payment, pk=pk)
+        if payment.payment_method == 'stripe':
+            return Response(
+                {'detail': 'Оплата через stripe подтверждается вебхуком'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if payment.status != Payment.STATUS_PAID:
+            # Сохраняем через save, чтобы сигналы сбросили кеш прав и аналитику платежей
+            payment.status = Payment.STATUS_PAID
+            payment.save(update_fields=['status'])
+        return Response(PaymentSerializer(payment, context={'request': request}).data)
+
 
 class PaymentStatusAPIView(APIView):
     """Эндпоинт для получения статуса платежа по ID сессии Stripe"""
 
     def get(self, request, session_id):
-        session = stripe.checkout.Session.retrieve(session_id)
-        payment_status = session.get('payment_status', 'unknown')
+        payment_status = get_payment_status(session_id)
+        if payment_status is None:
+            raise Http404
 
         return JsonResponse({
-            'session_id': session.id,
+            'session_id': session_id,
             'payment_status': payment_status
         })
 
 
+class StripeWebhookAPIView(APIView):
+    """Эндпоинт для вебхуков Stripe, подпись проверяется по STRIPE_WEBHOOK_SECRET"""
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            return JsonResponse(
+                {'detail': 'Вебхуки stripe не настроены: не задан STRIPE_WEBHOOK_SECRET'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        try:
+            handle_stripe_event(request.body, request.headers.get('Stripe-Signature', ''))
+        except (ValueError, stripe.SignatureVerificationError):
+            return JsonResponse({'detail': 'Неверная подпись вебхука'}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({'received': True})
+
+
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
\ No newline at end of file